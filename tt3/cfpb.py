@@ -3,9 +3,36 @@ Team Tutorial #4: Dictionaries
 CAPP 30121
 """
 
-import json
+import functools
+import os
+
+import cfpb_data
+
+CFPB_16_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "cfpb16_1000.json")
+
+
+@functools.lru_cache(maxsize=None)
+def load_cfpb_16():
+    """
+    Loads the sample of complaints received by CFPB in 2016. The file
+    is only read the first time; later calls return the same list.
+
+    Returns: (list) of complaints, where each complaint is a dictionary
+    """
+    return list(cfpb_data.read_complaints(CFPB_16_FILENAME))
+
+
+def __getattr__(name):
+    """
+    Loads CFPB_16 the first time it is used (as cfpb.CFPB_16 or with
+    "from cfpb import CFPB_16"), rather than when cfpb is imported.
+    """
+    if name == "CFPB_16":
+        return load_cfpb_16()
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
 
-CFPB_16 = json.load(open("cfpb16_1000.json"))
 
 # Task 1
 def find_companies(complaints):
@@ -19,9 +46,10 @@ def find_companies(complaints):
     Returns: (list or set) of companies
     """
 
-    # Your code goes here
-    # replace [] with a suitable return value
-    return []
+    companies = set()
+    for complaint in complaints:
+        companies.add(complaint["Company"])
+    return companies
 
 
 # Task 2
@@ -37,9 +65,11 @@ def count_complaints_about(complaints, company_name):
     Returns: (int) count of complaints
     """
 
-    # Your code goes here
-    # replace 0 with a suitable return value
-    return 0
+    count = 0
+    for complaint in complaints:
+        if complaint["Company"] == company_name:
+            count += 1
+    return count
 
 
 # Task 3
@@ -54,9 +84,11 @@ def count_by_state(complaints):
     Returns: (dict) that relates states to complaint number
     """
 
-    # Your code goes here
-    # replace {} with a suitable return value
-    return {}
+    counts = {}
+    for complaint in complaints:
+        state = complaint["State"]
+        counts[state] = counts.get(state, 0) + 1
+    return counts
 
 
 # Task 4
@@ -71,9 +103,13 @@ def state_with_most_complaints(cnt_by_state):
     Returns: (str) the state with the most complaints
     """
 
-    # Your code goes here
-    # replace "" with a suitable return value
-    return ""
+    top_state = ""
+    top_count = 0
+    for state, count in cnt_by_state.items():
+        if count > top_count:
+            top_state = state
+            top_count = count
+    return top_state
 
 
 # Task 5
@@ -89,9 +125,12 @@ def count_by_company_by_state(complaints):
     Returns: (dict) with count per company per state
     """
 
-    # Your code goes here
-    # replace {} with a suitable return value
-    return {}
+    counts = {}
+    for complaint in complaints:
+        by_state = counts.setdefault(complaint["Company"], {})
+        state = complaint["State"]
+        by_state[state] = by_state.get(state, 0) + 1
+    return counts
 
 
 # Task 6
@@ -107,9 +146,10 @@ def complaints_by_company(complaints):
     Returns: (dict) mapping the name of the company to a list of complaints
     """
 
-    # Your code goes here
-    # replace {} with a suitable return value
-    return {}
+    by_company = {}
+    for complaint in complaints:
+        by_company.setdefault(complaint["Company"], []).append(complaint)
+    return by_company
 
 
 # Task 7
@@ -128,6 +168,8 @@ def count_by_company_by_state_2(complaints):
         count_by_state
     """
 
-    # Your code goes here
-    # replace {} with a suitable return value
-    return {}
+    counts = {}
+    for company, company_complaints in complaints_by_company(
+            complaints).items():
+        counts[company] = count_by_state(company_complaints)
+    return counts
@@ -0,0 +1,269 @@
+"""
+Team Tutorial #3: Reading CFPB complaint data
+
+Reads complaint files one complaint at a time, so that the full CFPB
+dump (millions of complaints, many with long narratives) can be
+processed without loading it all in memory. Two formats are
+supported: a JSON array of complaint dictionaries (like
+cfpb16_1000.json) and JSON lines (one complaint dictionary per line).
+Files ending in ".gz" are decompressed while they are read.
+"""
+
+import gzip
+import json
+import re
+
+# Number of characters read from the file at a time
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# Characters that cannot be part of a JSON number or literal (true,
+# false, null): a value that is cut off at the end of the buffer has
+# none of them after the point where decoding it failed
+TOKEN_END = re.compile(r'[ \t\n\r,:\[\]{}"]')
+
+
+def open_complaints_file(filename):
+    """
+    Opens a complaints file for reading as text.
+
+    Args:
+        filename (str): Path of the file
+
+    Returns: (file object) the open file
+    """
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rt", encoding="utf-8")
+    return open(filename, encoding="utf-8")
+
+
+def may_be_cut_off(buffer, pos):
+    """
+    Checks whether an error found at position pos of a buffer may be
+    due to a value that goes on in the next chunk (e.g., "2." or
+    "tru" at the end of the buffer), rather than to invalid JSON.
+    """
+    return TOKEN_END.search(buffer, pos) is None
+
+
+def check_array_end(f, rest, chunk_size):
+    """
+    Checks that nothing but whitespace follows a JSON array: first in
+    the rest of the buffer, then in the rest of the file.
+
+    Raises: ValueError if something else does
+    """
+    while True:
+        if WHITESPACE.match(rest).end() < len(rest):
+            raise ValueError("Extra data after JSON array")
+        rest = f.read(chunk_size)
+        if not rest:
+            return
+
+
+def iter_json_array(f, chunk_size=CHUNK_SIZE):
+    """
+    Decodes the values in a JSON array one at a time, reading the
+    array a chunk at a time.
+
+    Args:
+        f (file object): A text file with a JSON array
+        chunk_size (int): The number of characters to read at a time
+
+    Returns: (generator) the values in the array
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    # What comes next: "[", the first value or "]", a "," or "]"
+    # after a value, or a value after a ","
+    expected = "["
+
+    while True:
+        pos = WHITESPACE.match(buffer, pos).end()
+
+        complete = pos < len(buffer)
+        error = None
+        if complete and (expected == "value" or
+                         expected == "first" and buffer[pos] != "]"):
+            # A value is only complete if it is followed by the "," or
+            # "]" after it. Otherwise it may go on in the next chunk
+            # (a number like "2." may be cut off, for example). Errors
+            # that more data cannot fix are raised right away, so that
+            # invalid JSON is not buffered until the end of the file.
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                after = WHITESPACE.match(buffer, end).end()
+                complete = buffer[after:after + 1] in (",", "]")
+                if not complete and after < len(buffer) and \
+                   not may_be_cut_off(buffer, end):
+                    raise ValueError("Expected ',' or ']' in JSON array")
+            except json.JSONDecodeError as e:
+                # A string may be cut off anywhere. (A string cannot
+                # hold a raw newline, so a missing quote fails at the
+                # end of its line, rather than at the end of the file.)
+                if not (e.msg.startswith("Unterminated string") or
+                        may_be_cut_off(buffer, e.pos)):
+                    raise ValueError("Invalid JSON value: " + str(e)) \
+                        from None
+                complete = False
+                error = "Invalid JSON value: " + str(e)
+
+        if not complete:
+            more = f.read(max(chunk_size, len(buffer) - pos))
+            if not more:
+                raise ValueError(error or "Unexpected end of JSON array")
+            buffer = buffer[pos:] + more
+            pos = 0
+            continue
+
+        char = buffer[pos]
+        if expected == "[":
+            if char != "[":
+                raise ValueError("Expected a JSON array")
+            pos += 1
+            expected = "first"
+        elif expected == "comma" or char == "]":
+            if char == "]":
+                check_array_end(f, buffer[pos + 1:], chunk_size)
+                return
+            if char != ",":
+                raise ValueError("Expected ',' or ']' in JSON array")
+            pos += 1
+            expected = "value"
+        else:
+            yield value
+            pos = end
+            expected = "comma"
+
+
+def iter_json_lines(f):
+    """
+    Decodes the values in a JSON lines file (one JSON value per line,
+    blank lines are skipped) one at a time.
+
+    Args:
+        f (file object): A text file with JSON lines
+
+    Returns: (generator) the values
+    """
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def is_json_array(filename, chunk_size=CHUNK_SIZE):
+    """
+    Checks whether a complaints file is a JSON array (rather than JSON
+    lines), from its first character.
+
+    Args:
+        filename (str): Path of the file
+        chunk_size (int): The number of characters to look at
+
+    Returns: (bool) True if the file is a JSON array
+    """
+    with open_complaints_file(filename) as f:
+        return f.read(chunk_size).lstrip()[:1] == "["
+
+
+def read_complaints(filename, fields=None, chunk_size=CHUNK_SIZE):
+    """
+    Reads the complaints in a file one at a time. The format (a JSON
+    array or JSON lines) is detected from the first character of the
+    file.
+
+    Only one complaint is in memory at a time, so a function that
+    makes a single pass over its complaints (like count_by_state)
+    can process the full dump in constant memory:
+
+        count_by_state(read_complaints("complaints.json",
+                                       fields=["State"]))
+
+    Args:
+        filename (str): Path of the file
+        fields (list of str): Keep only these fields of each complaint
+            (e.g., ["Company", "State", "Date received"]). Fields that
+            a complaint does not have are left out. By default, all
+            the fields are kept.
+        chunk_size (int): The number of characters read at a time
+            from a JSON array
+
+    Returns: (generator) the complaints, as dictionaries, in file order
+    """
+    json_array = is_json_array(filename, chunk_size)
+    with open_complaints_file(filename) as f:
+        if json_array:
+            complaints = iter_json_array(f, chunk_size)
+        else:
+            complaints = iter_json_lines(f)
+
+        if fields is None:
+            yield from complaints
+            return
+
+        for complaint in complaints:
+            yield {field: complaint[field] for field in fields
+                   if field in complaint}
+
+
+def write_json_lines(filename, complaints):
+    """
+    Writes complaints to a (not compressed) JSON lines file, one
+    complaint per line. This is the format that cfpb_parallel reads
+    in parallel.
+
+    Args:
+        filename (str): Path of the file
+        complaints (iterable of dict): The complaints (for example,
+            from read_complaints, to convert a JSON array)
+
+    Returns: (int) the number of complaints written
+    """
+    n = 0
+    with open(filename, "w", encoding="utf-8") as f:
+        for complaint in complaints:
+            f.write(json.dumps(complaint))
+            f.write("\n")
+            n += 1
+    return n
+
+
+def read_complaint_lines(filename, start, end, fields=None):
+    """
+    Reads the complaints in part of a (not compressed) JSON lines
+    file: those on the lines that start at a byte offset in
+    [start, end). Splitting a file into consecutive byte ranges, and
+    reading each range with this function, reads each complaint
+    exactly once.
+
+    Args:
+        filename (str): Path of the file
+        start (int): The first byte offset
+        end (int): The byte offset where the range ends
+        fields (list of str): Keep only these fields of each complaint
+            (see read_complaints)
+
+    Returns: (generator) the complaints, as dictionaries, in file order
+    """
+    with open(filename, "rb") as f:
+        if start > 0:
+            # Skip the rest of the line that starts before the range
+            # (nothing, if the byte before the range is a newline)
+            f.seek(start - 1)
+            start += len(f.readline()) - 1
+
+        pos = start
+        for line in f:
+            if pos >= end:
+                break
+            pos += len(line)
+            if not line.strip():
+                continue
+            complaint = json.loads(line)
+            if fields is None:
+                yield complaint
+            else:
+                yield {field: complaint[field] for field in fields
+                       if field in complaint}
@@ -0,0 +1,228 @@
+"""
+Team Tutorial #3: Parallel counts of CFPB complaints
+
+Counting complaints (by state, or by company and state) is a
+reduction whose partial results can be merged: the counts for a file
+are the sums of the counts for any partition of its complaints. The
+functions in this module split a complaints file into partitions,
+apply the serial functions from cfpb.py to each partition in a pool
+of processes, and merge the partial counts, in partition order. The
+result is the same as applying the serial function to all the
+complaints at once.
+
+Uncompressed JSON lines files are split into byte ranges, which each
+process reads (and decodes) itself, so decoding, which is most of the
+work, is done in parallel. Other files (JSON arrays and compressed
+files) can only be read from the start. They are only supported for
+compatibility: the main process reads and decodes them, and hands
+them out a partition at a time, so only the (cheap) counting is done
+in parallel, and this is no faster than the serial functions. Convert
+them to uncompressed JSON lines first (see
+cfpb_data.write_json_lines):
+
+    cfpb_data.write_json_lines("complaints.jsonl",
+                               cfpb_data.read_complaints("complaints.json"))
+"""
+
+import collections
+import concurrent.futures
+import os
+
+import cfpb
+import cfpb_data
+
+# Number of complaints in each partition of a file that is read by the
+# main process, and number of bytes in each byte range of a JSON lines
+# file
+PARTITION_SIZE = 50000
+PARTITION_BYTES = 64 * 1024 * 1024
+
+
+def merge_counts(total, partial):
+    """
+    Adds partial counts (e.g., from count_by_state) to a total.
+
+    Args:
+        total (dict): The total counts, which are updated
+        partial (dict): The counts to add
+
+    Returns: (dict) the total counts
+    """
+    for key, count in partial.items():
+        total[key] = total.get(key, 0) + count
+    return total
+
+
+def merge_nested_counts(total, partial):
+    """
+    Adds partial nested counts (e.g., from count_by_company_by_state,
+    {company: {state: count}}) to a total.
+
+    Args:
+        total (dict): The total counts, which are updated
+        partial (dict): The counts to add
+
+    Returns: (dict) the total counts
+    """
+    for key, counts in partial.items():
+        merge_counts(total.setdefault(key, {}), counts)
+    return total
+
+
+def map_byte_range(map_function, filename, start, end, fields):
+    """
+    Applies a function to the complaints in a byte range of a JSON
+    lines file (see cfpb_data.read_complaint_lines). Runs in a worker
+    process.
+    """
+    return map_function(list(cfpb_data.read_complaint_lines(
+        filename, start, end, fields)))
+
+
+def byte_ranges(filename, n):
+    """
+    Splits a file into (at most) n consecutive byte ranges.
+
+    Args:
+        filename (str): Path of the file
+        n (int): The number of ranges
+
+    Returns: (list of tuples) the (start, end) offsets of each range
+    """
+    size = os.path.getsize(filename)
+    step = max(1, -(-size // n))
+    return [(start, min(start + step, size))
+            for start in range(0, size, step)]
+
+
+def iter_partitions(complaints, partition_size):
+    """
+    Splits complaints into consecutive partitions.
+
+    Args:
+        complaints (iterable of dict): The complaints
+        partition_size (int): The number of complaints per partition
+
+    Returns: (generator) the partitions, as lists of complaints
+    """
+    partition = []
+    for complaint in complaints:
+        partition.append(complaint)
+        if len(partition) == partition_size:
+            yield partition
+            partition = []
+    if partition:
+        yield partition
+
+
+def map_in_order(executor, map_function, partitions, limit):
+    """
+    Applies a function to partitions in an executor, keeping at most
+    limit partitions in flight (so that a large file is not read into
+    memory faster than it is processed).
+
+    Returns: (generator) the results, in partition order
+    """
+    pending = collections.deque()
+    for partition in partitions:
+        if len(pending) == limit:
+            yield pending.popleft().result()
+        pending.append(executor.submit(map_function, partition))
+    while pending:
+        yield pending.popleft().result()
+
+
+def map_reduce(filename, map_function, merge_function, fields=None,
+               workers=None, partition_size=PARTITION_SIZE):
+    """
+    Applies a function to the partitions of a complaints file in
+    parallel, and merges the results.
+
+    Only uncompressed JSON lines files are read in parallel. JSON
+    arrays and compressed files are read by this process (see the
+    module docstring), which makes this no faster than applying
+    map_function serially.
+
+    Args:
+        filename (str): Path of the complaints file (see
+            cfpb_data.read_complaints), preferably uncompressed JSON
+            lines
+        map_function (function): Takes a list of complaints and returns
+            a partial result. It must be defined at the top level of a
+            module (e.g., cfpb.count_by_state), so that it can be sent
+            to the worker processes.
+        merge_function (function): Takes the total so far and a partial
+            result, and returns the new total (e.g., merge_counts). It
+            must be associative, and is called in partition order,
+            starting from an empty dictionary.
+        fields (list of str): Read only these fields of each complaint
+            (the fields used by map_function). By default, all the
+            fields are read.
+        workers (int): The number of processes (default: the number
+            of CPUs). With one worker, map_function is applied to all
+            the complaints at once.
+        partition_size (int): The number of complaints per partition,
+            for files that are read by the main process
+
+    Returns: the merged result
+    """
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        return map_function(list(cfpb_data.read_complaints(
+            filename, fields)))
+
+    total = {}
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        if (filename.endswith(".gz") or
+                cfpb_data.is_json_array(filename)):
+            # Compatibility fallback: only map_function runs in the
+            # workers
+            partitions = iter_partitions(
+                cfpb_data.read_complaints(filename, fields), partition_size)
+            partials = map_in_order(executor, map_function, partitions,
+                                    2 * workers)
+        else:
+            n = max(4 * workers,
+                    os.path.getsize(filename) // PARTITION_BYTES)
+            futures = [executor.submit(map_byte_range, map_function,
+                                       filename, start, end, fields)
+                       for start, end in byte_ranges(filename, n)]
+            partials = (future.result() for future in futures)
+
+        for partial in partials:
+            total = merge_function(total, partial)
+    return total
+
+
+def count_by_state(filename, workers=None):
+    """
+    Computes counts by state of all the complaints in a file, in
+    parallel (see cfpb.count_by_state).
+
+    Args:
+        filename (str): Path of the complaints file
+        workers (int): The number of processes (default: the number
+            of CPUs)
+
+    Returns: (dict) that relates states to complaint number
+    """
+    return map_reduce(filename, cfpb.count_by_state, merge_counts,
+                      fields=["State"], workers=workers)
+
+
+def count_by_company_by_state(filename, workers=None):
+    """
+    Computes a dict of {company: {state: count}} for all the
+    complaints in a file, in parallel (see
+    cfpb.count_by_company_by_state).
+
+    Args:
+        filename (str): Path of the complaints file
+        workers (int): The number of processes (default: the number
+            of CPUs)
+
+    Returns: (dict) with count per company per state
+    """
+    return map_reduce(filename, cfpb.count_by_company_by_state,
+                      merge_nested_counts, fields=["Company", "State"],
+                      workers=workers)
@@ -0,0 +1,179 @@
+"""
+Team Tutorial #3: Inverted index over complaints
+
+A ComplaintIndex is built once (and can grow as new complaints
+arrive). For each indexed field and each value of the field, it keeps
+a posting list: the positions of the complaints with that value, in
+increasing order. Counting the complaints about a company is then a
+dictionary lookup, instead of a pass over all the complaints, and
+finding the complaints that match several conditions (such as
+"company X in state Y") only walks the posting lists of those values.
+"""
+
+import array
+import bisect
+
+# The fields that are indexed by default
+INDEXED_FIELDS = ("Company", "State", "Product", "Issue")
+
+EMPTY = array.array("l")
+
+
+class ComplaintIndex:
+    """
+    An inverted index over complaints.
+
+    A ComplaintIndex has the following attributes:
+        fields (tuple of str): The indexed fields
+        complaints (list of dict): The complaints, in the order in which
+            they were added (a complaint is identified by its position
+            in this list)
+        postings (dict): Maps each indexed field to a dictionary that
+            maps each value of the field to the (increasing) positions
+            of the complaints with that value
+    """
+
+    def __init__(self, complaints=(), fields=INDEXED_FIELDS):
+        """
+        Constructor.
+
+        Args:
+            complaints (iterable of dict): The complaints to index (for
+                example, from cfpb_data.read_complaints)
+            fields (list of str): The fields to index
+        """
+        self.fields = tuple(fields)
+        self.complaints = []
+        self.postings = {field: {} for field in self.fields}
+        self.extend(complaints)
+
+    def add(self, complaint):
+        """
+        Adds a complaint to the index. A missing field is indexed as "".
+
+        Args:
+            complaint (dict): The complaint
+
+        Returns: (int) the position of the complaint
+        """
+        position = len(self.complaints)
+        self.complaints.append(complaint)
+        for field in self.fields:
+            value = complaint.get(field, "")
+            postings = self.postings[field].get(value)
+            if postings is None:
+                postings = self.postings[field][value] = array.array("l")
+            postings.append(position)
+        return position
+
+    def extend(self, complaints):
+        """
+        Adds complaints to the index.
+
+        Args:
+            complaints (iterable of dict): The complaints
+        """
+        for complaint in complaints:
+            self.add(complaint)
+
+    def __len__(self):
+        return len(self.complaints)
+
+    def values(self, field):
+        """
+        Returns: (list of str) the distinct values of an indexed field
+        """
+        return list(self.field_postings(field))
+
+    def field_postings(self, field):
+        """
+        Returns the posting lists of an indexed field, or raises
+        ValueError if the field is not indexed.
+        """
+        if field not in self.postings:
+            raise ValueError("Field not indexed: " + field)
+        return self.postings[field]
+
+    def positions(self, field, value):
+        """
+        Returns: (array of int) the positions of the complaints with a
+            given value in an indexed field, in increasing order
+        """
+        return self.field_postings(field).get(value, EMPTY)
+
+    def count(self, field, value):
+        """
+        Counts the complaints with a given value in an indexed field
+        (e.g., the complaints about a company), in constant time.
+
+        Args:
+            field (str): The field (e.g., "Company")
+            value (str): The value (e.g., "Discover")
+
+        Returns: (int) the number of complaints
+        """
+        return len(self.positions(field, value))
+
+    def lookup(self, field, value):
+        """
+        Returns: (list of dict) the complaints with a given value in an
+            indexed field, in the order in which they were added
+        """
+        return [self.complaints[i] for i in self.positions(field, value)]
+
+    def positions_where(self, conditions):
+        """
+        Finds the complaints that match several conditions, by
+        intersecting their posting lists. The shortest list is walked,
+        and the others are searched (with binary search, from where
+        the previous search stopped), so the time depends on the
+        length of the shortest list, not on the number of complaints.
+
+        Args:
+            conditions (dict): Maps indexed fields to values (e.g.,
+                {"Company": "Discover", "State": "MN"})
+
+        Returns: (list of int) the positions of the matching
+            complaints, in increasing order
+        """
+        if not conditions:
+            return list(range(len(self.complaints)))
+
+        lists = sorted((self.positions(field, value)
+                        for field, value in conditions.items()), key=len)
+        shortest, others = lists[0], lists[1:]
+        starts = [0] * len(others)
+
+        result = []
+        for position in shortest:
+            for k, other in enumerate(others):
+                i = bisect.bisect_left(other, position, starts[k])
+                starts[k] = i
+                if i == len(other):
+                    # No later position can be in every list
+                    return result
+                if other[i] != position:
+                    break
+            else:
+                result.append(position)
+        return result
+
+    def count_where(self, conditions):
+        """
+        Counts the complaints that match several conditions (see
+        positions_where).
+
+        Returns: (int) the number of complaints
+        """
+        if len(conditions) == 1:
+            (field, value), = conditions.items()
+            return self.count(field, value)
+        return len(self.positions_where(conditions))
+
+    def lookup_where(self, conditions):
+        """
+        Returns: (list of dict) the complaints that match several
+            conditions (see positions_where), in the order in which
+            they were added
+        """
+        return [self.complaints[i] for i in self.positions_where(conditions)]
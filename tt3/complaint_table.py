@@ -0,0 +1,253 @@
+"""
+Team Tutorial #3: Columnar complaint table
+
+A ComplaintTable keeps a few fields of many complaints as columns,
+instead of one wide dictionary per complaint. Text fields (such as
+"Company" and "State") are dictionary-encoded: each distinct value is
+stored once, and each complaint only holds a small integer code for
+it. Dates are stored as day numbers. Counting the complaints by any
+combination of these fields is then a single pass over a few integer
+columns (see ComplaintTable.count_by).
+"""
+
+import array
+import collections
+import datetime
+import functools
+
+import cfpb_data
+
+# The text fields kept by default, and the date fields
+CATEGORICAL_FIELDS = ("Company", "State", "Product", "Issue",
+                      "Submitted via")
+DATE_FIELDS = ("Date received", "Date sent to company")
+
+DATE_FORMAT = "%m/%d/%Y"
+
+
+class Categorical:
+    """
+    A dictionary encoding for a text field: each distinct value is
+    stored once, in values, and is identified by a small integer code,
+    its position in values.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.values = []
+        self.codes = {}
+
+    def encode(self, value):
+        """
+        Returns the integer code for value, adding it to the
+        dictionary if it has not been seen before.
+        """
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.codes[value] = code
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_date(s):
+    """
+    Parses a CFPB date (e.g., "02/17/2016").
+
+    Args:
+        s (str): The date, or "" if it is missing
+
+    Returns: (int) the proleptic Gregorian ordinal of the date (see
+        datetime.date.toordinal), or 0 if the date is missing
+    """
+    if s == "":
+        return 0
+    return datetime.datetime.strptime(s, DATE_FORMAT).toordinal()
+
+
+class ComplaintTable:
+    """
+    Columnar storage for some of the fields of many complaints.
+
+    A ComplaintTable has the following attributes:
+        fields (tuple of str): The text fields, which are dictionary
+            encoded
+        date_fields (tuple of str): The date fields
+        categories (dict): Maps each text field to its Categorical
+        columns (dict): Maps each field to an array with the value (a
+            code, or a date ordinal) of each complaint, in the order
+            in which the complaints were added
+    """
+
+    def __init__(self, fields=CATEGORICAL_FIELDS, date_fields=DATE_FIELDS):
+        """
+        Constructor.
+
+        Args:
+            fields (list of str): The text fields to keep
+            date_fields (list of str): The date fields to keep
+        """
+        self.fields = tuple(fields)
+        self.date_fields = tuple(date_fields)
+        self.categories = {field: Categorical() for field in self.fields}
+        self.columns = {field: array.array("l")
+                        for field in self.fields + self.date_fields}
+
+    def append(self, complaint):
+        """
+        Adds a complaint to the table. Missing fields are stored as ""
+        (or, for dates, as a missing date).
+
+        Args:
+            complaint (dict): The complaint
+        """
+        for field in self.fields:
+            code = self.categories[field].encode(complaint.get(field, ""))
+            self.columns[field].append(code)
+        for field in self.date_fields:
+            self.columns[field].append(parse_date(complaint.get(field, "")))
+
+    def extend(self, complaints):
+        """
+        Adds complaints to the table.
+
+        Args:
+            complaints (iterable of dict): The complaints (for example,
+                from cfpb_data.read_complaints)
+        """
+        for complaint in complaints:
+            self.append(complaint)
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(next(iter(self.columns.values())))
+
+    def decode(self, field, code):
+        """
+        Returns the value of a field that a code in its column stands
+        for: a string for text fields, and a datetime.date (or None
+        if the date is missing) for date fields.
+        """
+        if field in self.categories:
+            return self.categories[field].values[code]
+        if code == 0:
+            return None
+        return datetime.date.fromordinal(code)
+
+    def column(self, field):
+        """
+        Returns the column of a field, or raises ValueError if the
+        table does not have the field.
+        """
+        if field not in self.columns:
+            raise ValueError("Field not in the complaint table: " + field)
+        return self.columns[field]
+
+    def count(self, field, value):
+        """
+        Counts the complaints that have a given value in a field.
+
+        Args:
+            field (str): The field (e.g., "Company")
+            value (str or datetime.date): The value (e.g., "Discover")
+
+        Returns: (int) the number of complaints
+        """
+        column = self.column(field)
+        if field in self.categories:
+            code = self.categories[field].codes.get(value)
+            if code is None:
+                return 0
+        else:
+            code = value.toordinal() if value else 0
+        return column.count(code)
+
+    def count_by(self, keys):
+        """
+        Counts the complaints by the values of one or more fields, in
+        a single pass over their columns.
+
+        Args:
+            keys (list of str): The fields (e.g., ["Company", "State"])
+
+        Returns: (dict) that maps tuples of values of the fields (e.g.,
+            ("Discover", "MN")) to the number of complaints with those
+            values. With no fields, all the complaints are in a single
+            group, ().
+        """
+        if not keys:
+            # zip() of no columns would yield no groups at all
+            return {(): len(self)} if len(self) else {}
+
+        columns = [self.column(key) for key in keys]
+        counts = collections.Counter(zip(*columns))
+
+        decoders = []
+        for key in keys:
+            if key in self.categories:
+                decoders.append(self.categories[key].values.__getitem__)
+            else:
+                decoders.append(functools.partial(self.decode, key))
+
+        return {tuple(decode(code) for decode, code in zip(decoders, group)):
+                count for group, count in counts.items()}
+
+    def count_by_many(self, groupings):
+        """
+        Computes several breakdowns of the complaints.
+
+        Args:
+            groupings (list of lists of str): The keys of each
+                breakdown (see count_by)
+
+        Returns: (dict) that maps the tuple of keys of each breakdown
+            to its counts
+        """
+        return {tuple(keys): self.count_by(keys) for keys in groupings}
+
+
+def nest(counts):
+    """
+    Turns counts keyed by tuples of values into nested dictionaries,
+    like those of count_by_company_by_state in cfpb.py: for example,
+    {("Discover", "MN"): 3} becomes {"Discover": {"MN": 3}}.
+
+    Args:
+        counts (dict): Counts from ComplaintTable.count_by
+
+    Returns: (dict) the nested counts
+    """
+    nested = {}
+    for group, count in counts.items():
+        level = nested
+        for value in group[:-1]:
+            level = level.setdefault(value, {})
+        level[group[-1]] = count
+    return nested
+
+
+def read_complaint_table(filename, fields=CATEGORICAL_FIELDS,
+                         date_fields=DATE_FIELDS):
+    """
+    Builds a complaint table from a complaints file, reading (and
+    keeping) only the fields of the table.
+
+    Args:
+        filename (str): Path of the complaints file (see
+            cfpb_data.read_complaints)
+        fields (list of str): The text fields to keep
+        date_fields (list of str): The date fields to keep
+
+    Returns: (ComplaintTable) the table
+    """
+    table = ComplaintTable(fields, date_fields)
+    table.extend(cfpb_data.read_complaints(
+        filename, fields=list(fields) + list(date_fields)))
+    return table
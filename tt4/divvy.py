@@ -2,17 +2,51 @@
 Team Tutorial #4: Divvy Bike example
 """
 
+import argparse
+import array
+import calendar
+import collections
+import concurrent.futures
+import cProfile
 import csv
+import glob
+import gzip
+import heapq
+import io
+import itertools
+import json
+import locale
+import os
 import sys
 import time
 import math
 import operator
 
+# NumPy is optional: it is only used to speed up batched computations
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from divvy_distances import EARTH_RADIUS, DistanceMatrix, file_digest
+from divvy_flow import FlowMatrix
+from divvy_instrumentation import (NO_INSTRUMENTATION, Instrumentation,
+                                   instrumented)
+from divvy_snapshot import (map_snapshot_columns, read_snapshot_header,
+                            write_snapshot)
+from divvy_spatial import SpatialIndex
+from divvy_time import (DAY, HOUR, MINUTE, TIME_PARSERS, TimeIndex,
+                        epoch_to_struct_time)
+
+
 class Location:
     """
     Represents a geographic location
     """
 
+    # Use slots instead of a per-instance dictionary, to save memory
+    __slots__ = ("latitude", "longitude")
+
     def __init__(self, latitude, longitude):
         """
         Constructor
@@ -43,7 +77,7 @@ class Location:
              math.sin(diff_longitude/2) * math.sin(diff_longitude/2)
         d = 2 * math.asin(math.sqrt(a))
 
-        return 6371000.0 * d
+        return EARTH_RADIUS * d
 
 
     def __str__(self):
@@ -77,6 +111,9 @@ class DivvyStation:
     See constructor for description of attributes.
     """
 
+    __slots__ = ("station_id", "name", "location", "dpcapacity",
+                 "landmark", "online_date")
+
     def __init__(self, station_id, name, latitude, longitude,
                  dpcapacity, landmark, online_date):
         """
@@ -135,9 +172,16 @@ class DivvyTrip:
     """
     Represents a single Divvy trip.
 
-    See constructor for description of attributes.
+    See constructor for description of attributes. To keep trips
+    small, the start and stop times are stored as seconds since the
+    epoch (in the start and stop attributes); the starttime and
+    stoptime attributes convert them to struct_time when accessed.
     """
 
+    __slots__ = ("trip_id", "start", "stop", "bikeid", "tripduration",
+                 "from_station", "to_station", "usertype", "gender",
+                 "birthyear")
+
     def __init__(self, trip_id, starttime, stoptime, bikeid,
                  tripduration, from_station, to_station,
                  usertype, gender, birthyear):
@@ -149,8 +193,9 @@ class DivvyTrip:
 
         Args:
         - trip_id: (integer) A unique identifier for the trip.
-        - starttime, and stoptime: (string) Date and time for the start
-          and end time of the trip.
+        - starttime, and stoptime: (struct_time or integer) Date and time
+          for the start and end time of the trip, either as struct_time
+          or as seconds since the epoch.
         - bikeid: (integer) A unique identifier for the bike used in this trip.
         - tripduration: (integer) The duration (in seconds) of the trip.
         - from_station_id, to_station_id: (integer) The identifiers of the
@@ -177,6 +222,28 @@ class DivvyTrip:
         self.gender = gender
         self.birthyear = birthyear
 
+    @property
+    def starttime(self):
+        """The start time of the trip (struct_time)"""
+        return epoch_to_struct_time(self.start)
+
+    @starttime.setter
+    def starttime(self, t):
+        if isinstance(t, time.struct_time):
+            t = calendar.timegm(t)
+        self.start = t
+
+    @property
+    def stoptime(self):
+        """The stop time of the trip (struct_time)"""
+        return epoch_to_struct_time(self.stop)
+
+    @stoptime.setter
+    def stoptime(self, t):
+        if isinstance(t, time.struct_time):
+            t = calendar.timegm(t)
+        self.stop = t
+
     def get_distance(self):
         """
         Returns the distance from the origin station to the
@@ -199,32 +266,1534 @@ class DivvyTrip:
         return s
 
 
+# Number of rows of the trips file that are parsed at a time
+READ_BATCH_SIZE = 10000
+
+class Categorical:
+    """
+    A dictionary encoding for a categorical field (such as the user
+    type of a trip): each distinct value is stored once, in values,
+    and is identified by a small integer code, its position in
+    values. A Categorical can be indexed by code, like values.
+    """
+
+    def __init__(self, values=()):
+        """
+        Constructor.
+
+        Args:
+        - values: (iterable) Values to encode, in the order of their
+          codes (optional)
+        """
+        self.values = []
+        self.codes = {}
+        for value in values:
+            self.encode(value)
+
+    def encode(self, value):
+        """
+        Returns the integer code for value, adding it to the
+        dictionary if it has not been seen before.
+        """
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.codes[value] = code
+        return code
+
+    def intern(self, value):
+        """
+        Returns the shared copy of a value that is equal to value,
+        adding value to the dictionary if it has not been seen before.
+        """
+        return self.values[self.encode(value)]
+
+    def remap(self, other):
+        """
+        Returns: (list of integers) The code in this dictionary of
+          each value of another Categorical, by code (values that
+          are not in this dictionary are added)
+        """
+        return [self.encode(value) for value in other.values]
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+
+class TripStore:
+    """
+    Columnar storage for Divvy trips.
+
+    Instead of one DivvyTrip object per trip, a TripStore keeps one
+    typed array per field. Times are stored as integer seconds since
+    the epoch, stations as indices into a list of DivvyStation objects,
+    and usertype/gender as small integer codes (see Categorical). The
+    trips can be counted and summed by the values of these columns
+    (see count_by and sum_by).
+
+    A TripStore behaves like a read-only list of DivvyTrip objects:
+    len(), indexing and iteration are supported, and each access
+    builds a (short-lived) DivvyTrip view of the requested trip.
+
+    A store can also hold only some of the columns (see TripQuery).
+    The other columns are then None, and DivvyTrip views are not
+    available.
+    """
+
+    # Column name and array typecode, in the order used by append().
+    # usertype codes are not bounded by the data (each new usertype
+    # string gets a new code), so they get a wider type than gender,
+    # which only has a few valid values. Birth years that do not fit
+    # are rejected by the parsers (see parse_trip_birthyear).
+    COLUMNS = (("trip_id", "q"),
+               ("start", "q"),
+               ("stop", "q"),
+               ("bikeid", "q"),
+               ("tripduration", "q"),
+               ("from_idx", "l"),
+               ("to_idx", "l"),
+               ("usertype", "i"),
+               ("gender", "b"),
+               ("birthyear", "h"))
+
+    def __init__(self, stations, columns=None):
+        """
+        Constructor.
+
+        Args:
+        - stations: (list of DivvyStation) The stations referenced by
+          the from_idx and to_idx columns.
+        - columns: (list of strings) The names of the columns to keep,
+          in any order. By default, all of TripStore.COLUMNS.
+        """
+        names = [name for name, _ in TripStore.COLUMNS]
+        if columns is None:
+            columns = names
+        unknown = set(columns) - set(names)
+        if unknown or not columns:
+            raise ValueError("Invalid trip columns: {}".format(
+                sorted(unknown) or "none"))
+
+        self.stations = stations
+        # The names of the columns in the store, in COLUMNS order, and
+        # their positions in a tuple of trip fields
+        self.columns = tuple(name for name in names if name in columns)
+        self.positions = tuple((name, names.index(name))
+                               for name in self.columns)
+
+        # One array per column (None for the columns not in the store)
+        self.trip_id = self.new_column("trip_id")
+        self.start = self.new_column("start")
+        self.stop = self.new_column("stop")
+        self.bikeid = self.new_column("bikeid")
+        self.tripduration = self.new_column("tripduration")
+        self.from_idx = self.new_column("from_idx")
+        self.to_idx = self.new_column("to_idx")
+        self.usertype = self.new_column("usertype")
+        self.gender = self.new_column("gender")
+        self.birthyear = self.new_column("birthyear")
+
+        # Dictionaries for the categorical columns
+        self.usertypes = Categorical()
+        self.genders = Categorical([None])
+
+    def new_column(self, name):
+        """
+        Returns: (array) An empty array for a column of the store, or
+          None if the store does not have the column
+        """
+        if name not in self.columns:
+            return None
+        return array.array(dict(TripStore.COLUMNS)[name])
+
+    def append(self, row):
+        """
+        Adds a trip to the store. The store must be writable
+        (see make_writable).
+
+        Args:
+        - row: (tuple) The trip fields, in the order given by
+          TripStore.COLUMNS. usertype and gender are strings
+          (gender may be None). The fields of the columns that
+          are not in the store are ignored.
+        """
+        if len(self.columns) < len(TripStore.COLUMNS):
+            self.append_projected(row)
+            return
+
+        (trip_id, start, stop, bikeid, tripduration, from_idx, to_idx,
+         usertype, gender, birthyear) = row
+
+        self.trip_id.append(trip_id)
+        self.start.append(start)
+        self.stop.append(stop)
+        self.bikeid.append(bikeid)
+        self.tripduration.append(tripduration)
+        self.from_idx.append(from_idx)
+        self.to_idx.append(to_idx)
+        self.usertype.append(self.usertypes.encode(usertype))
+        self.gender.append(self.genders.encode(gender))
+        self.birthyear.append(birthyear)
+
+    def append_projected(self, row):
+        """
+        Adds a trip to a store that does not have all the columns
+        (see append).
+        """
+        for name, position in self.positions:
+            value = row[position]
+            if name == "usertype":
+                value = self.usertypes.encode(value)
+            elif name == "gender":
+                value = self.genders.encode(value)
+            getattr(self, name).append(value)
+
+    def make_writable(self):
+        """
+        Replaces any read-only columns (such as the memory-mapped
+        columns of a snapshot, see DivvyData.load_snapshot) with
+        arrays, so that trips can be added to the store.
+        """
+        for name, typecode in TripStore.COLUMNS:
+            column = getattr(self, name)
+            if column is not None and not isinstance(column, array.array):
+                writable = array.array(typecode)
+                writable.frombytes(column.cast("B"))
+                setattr(self, name, writable)
+
+    def extend(self, other):
+        """
+        Adds all the trips in another TripStore (with the same
+        stations and at least the same columns) to the end of this
+        store.
+
+        Args:
+        - other: (TripStore) The trips to add
+        """
+        self.make_writable()
+        code_maps = {"usertype": self.usertypes.remap(other.usertypes),
+                     "gender": self.genders.remap(other.genders)}
+
+        for name in self.columns:
+            column = getattr(other, name)
+            code_map = code_maps.get(name)
+            if code_map and code_map != list(range(len(code_map))):
+                column = [code_map[code] for code in column]
+
+            target = getattr(self, name)
+            try:
+                target.extend(column)
+            except BufferError:
+                # A slice of this store (see slice) is still using the
+                # array, so it cannot grow: leave it to the slice and
+                # continue with a copy.
+                target = array.array(target.typecode, target)
+                target.extend(column)
+                setattr(self, name, target)
+
+    def slice(self, start, stop):
+        """
+        Returns a TripStore with the trips in positions start to
+        stop - 1, without copying them: its columns are memoryviews
+        of this store's columns.
+
+        Note that, while a slice is alive, extend has to copy the
+        columns of this store before it can add trips to them.
+        """
+        trips = TripStore(self.stations, self.columns)
+        for name in self.columns:
+            setattr(trips, name, memoryview(getattr(self, name))[start:stop])
+
+        trips.usertypes = self.usertypes
+        trips.genders = self.genders
+        return trips
+
+    def rows(self):
+        """
+        Iterates over the trips as tuples of trip fields (in the
+        order given by TripStore.COLUMNS, with usertype and gender
+        decoded), without building DivvyTrip objects. The fields of
+        the columns that are not in the store are None.
+        """
+        usertypes = self.usertypes.values
+        genders = self.genders.values
+        columns = [getattr(self, name) for name, _ in TripStore.COLUMNS]
+        if len(self.columns) < len(columns):
+            missing = itertools.repeat(None)
+            columns = [missing if column is None else column
+                       for column in columns]
+            # Missing codes are "decoded" as None
+            if self.usertype is None:
+                usertypes = {None: None}
+            if self.gender is None:
+                genders = {None: None}
+
+        for (trip_id, start, stop, bikeid, tripduration, from_idx, to_idx,
+             usertype, gender, birthyear) in zip(*columns):
+            yield (trip_id, start, stop, bikeid, tripduration, from_idx,
+                   to_idx, usertypes[usertype], genders[gender], birthyear)
+
+    def categories(self, name):
+        """
+        Returns the values that the codes in a categorical column
+        stand for: usertype, gender, or the from_idx and to_idx
+        station columns.
+        """
+        if name == "usertype":
+            return self.usertypes.values
+        if name == "gender":
+            return self.genders.values
+        if name in ("from_idx", "to_idx"):
+            return self.stations
+        raise ValueError("Not a categorical trip column: " + name)
+
+    def group_codes(self, keys):
+        """
+        Combines the codes of several categorical columns into a
+        single group code per trip (the codes of the columns, as the
+        digits of a number whose bases are the number of values of
+        each column, see decode_group).
+
+        Args:
+        - keys: (list of strings) The names of the columns
+
+        Returns: (sequence of integers, list of sequences) The group
+          code of each trip (a NumPy array, if NumPy is available),
+          and the values of each column (see categories).
+        """
+        tables = [self.categories(name) for name in keys]
+
+        if np is not None:
+            codes = np.zeros(len(self), dtype=np.int64)
+            for name, table in zip(keys, tables):
+                column = np.asarray(getattr(self, name), dtype=np.int64)
+                codes = codes * len(table) + column
+            return codes, tables
+
+        codes = [0] * len(self)
+        for name, table in zip(keys, tables):
+            n = len(table)
+            codes = [code * n + value
+                     for code, value in zip(codes, getattr(self, name))]
+        return codes, tables
+
+    @staticmethod
+    def decode_group(code, tables):
+        """
+        Returns: (tuple) The values of the columns that a group code
+          (see group_codes) stands for
+        """
+        values = []
+        for table in reversed(tables):
+            code, value = divmod(code, len(table))
+            values.append(table[value])
+        return tuple(reversed(values))
+
+    def count_by(self, keys):
+        """
+        Counts the trips by the values of some categorical columns
+        (see categories). Only the groups that have trips are counted,
+        so the time and memory depend on the number of trips, not on
+        the number of possible combinations of values.
+
+        Args:
+        - keys: (list of strings) The names of the columns (e.g.,
+          ["usertype", "gender"])
+
+        Returns: (dictionary) Maps tuples of column values (e.g.,
+          ("Subscriber", "Female")) to the number of trips, for the
+          combinations that have trips, in group code order
+        """
+        codes, tables = self.group_codes(keys)
+
+        if np is not None:
+            groups, counts = np.unique(codes, return_counts=True)
+            pairs = zip(groups.tolist(), counts.tolist())
+        else:
+            pairs = sorted(collections.Counter(codes).items())
+
+        return {TripStore.decode_group(code, tables): count
+                for code, count in pairs}
+
+    def sum_by(self, keys, value):
+        """
+        Adds up a column by the values of some categorical columns
+        (see categories and count_by).
+
+        Args:
+        - keys: (list of strings) The names of the columns (e.g.,
+          ["usertype", "gender"])
+        - value: (string) The name of the column to add up (e.g.,
+          "tripduration")
+
+        Returns: (dictionary) Maps tuples of column values to the
+          total of value, for the combinations that have trips
+        """
+        codes, tables = self.group_codes(keys)
+        column = getattr(self, value)
+
+        if np is not None:
+            groups, inverse = np.unique(codes, return_inverse=True)
+            weights = np.asarray(column, dtype=np.float64)
+            # All the trip columns hold integers, so the totals are
+            # exact (as long as they are below 2**53)
+            totals = np.bincount(inverse, weights=weights,
+                                 minlength=len(groups)).tolist()
+            pairs = zip(groups.tolist(), (int(t) for t in totals))
+        else:
+            sums = {}
+            for code, x in zip(codes, column):
+                sums[code] = sums.get(code, 0) + x
+            pairs = sorted(sums.items())
+
+        return {TripStore.decode_group(code, tables): total
+                for code, total in pairs}
+
+    def nbytes(self):
+        """Returns the number of bytes used by the column arrays"""
+        return sum(len(getattr(self, name)) * getattr(self, name).itemsize
+                   for name in self.columns)
+
+    def __len__(self):
+        return len(getattr(self, self.columns[0]))
+
+    def __getitem__(self, i):
+        """
+        Builds a DivvyTrip view of the i-th trip in the store.
+        """
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if len(self.columns) < len(TripStore.COLUMNS):
+            raise ValueError("DivvyTrip views need all the trip columns")
+
+        return DivvyTrip(self.trip_id[i],
+                         self.start[i],
+                         self.stop[i],
+                         self.bikeid[i],
+                         self.tripduration[i],
+                         self.stations[self.from_idx[i]],
+                         self.stations[self.to_idx[i]],
+                         self.usertypes[self.usertype[i]],
+                         self.genders[self.gender[i]],
+                         self.birthyear[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class DivvyDataError(Exception):
+    """
+    Raised when a Divvy file has a row that cannot be parsed and
+    the error policy is "strict" (see RejectedRows)
+    """
+
+
+class RowError(ValueError):
+    """
+    Raised by the row parsers when a row cannot be parsed.
+
+    Attributes:
+    - reason: (string) One of the REJECT_REASONS
+    """
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+# Why a row was rejected
+SHORT_ROW = "short-row"
+BAD_VALUE = "bad-value"
+UNKNOWN_STATION = "unknown-station"
+UNKNOWN_GENDER = "unknown-gender"
+REJECT_REASONS = (SHORT_ROW, BAD_VALUE, UNKNOWN_STATION, UNKNOWN_GENDER)
+
+
+def parse_trip_fields(row, station_index, parse_time):
+    """
+    Parse a line from the trips CSV file into a tuple of
+    trip fields, without building any objects.
+
+    Args:
+    - row: (list of strings) Values in a single row of the
+      trips CSV file
+    - station_index: (dictionary: integer -> integer) Maps station
+      identifiers to station indices
+    - parse_time: (function) Converts a timestamp to epoch seconds
+      (one of the TIME_PARSERS)
+
+    Returns: (tuple) The trip fields, in the order given by
+      TripStore.COLUMNS. Times are seconds since the epoch and
+      stations are indices from station_index.
+
+    Raises: RowError if the row could not be parsed
+    """
+
+    try:
+        trip_id = int(row[0])
+
+        starttime = parse_time(row[1])
+        endtime = parse_time(row[2])
+
+        bikeid = int(row[3])
+        tripduration = int(row[4])
+
+        station_id = int(row[5])
+        if station_id not in station_index:
+            raise RowError(UNKNOWN_STATION,
+                           "Encountered unknown station: " + str(station_id))
+        from_station = station_index[station_id]
+        # Skip the station name (row[6]). We do not use it.
+
+        station_id = int(row[7])
+        if station_id not in station_index:
+            raise RowError(UNKNOWN_STATION,
+                           "Encountered unknown station: " + str(station_id))
+        to_station = station_index[station_id]
+        # Skip the station name (row[8]). We do not use it.
+
+        usertype = row[9]
+        gender = None
+        birthyear = 0
+
+        if usertype == "Subscriber":
+            gender = row[10]
+            if gender not in ["", "Male", "Female"]:
+                raise RowError(UNKNOWN_GENDER,
+                               "Encountered unknown gender: " + gender)
+
+            birthyear = parse_trip_birthyear(row)
+    except RowError:
+        raise
+    except IndexError:
+        raise RowError(SHORT_ROW, "Missing fields in line") from None
+    except ValueError as e:
+        raise RowError(BAD_VALUE, "Error in parsing line: " + str(e)) from None
+
+    return (trip_id, starttime, endtime, bikeid, tripduration,
+            from_station, to_station, usertype, gender, birthyear)
+
+
+def parse_trip_station(value, station_index):
+    """
+    Parse a station ID from the trips CSV file into a station index.
+
+    Raises: RowError if the station is unknown
+    """
+    station_id = int(value)
+    if station_id not in station_index:
+        raise RowError(UNKNOWN_STATION,
+                       "Encountered unknown station: " + str(station_id))
+    return station_index[station_id]
+
+
+def parse_trip_gender(row):
+    """
+    Parse the gender from a row of the trips CSV file (None unless
+    the user is a subscriber).
+
+    Raises: RowError if the gender is unknown
+    """
+    if row[9] != "Subscriber":
+        return None
+    gender = row[10]
+    if gender not in ["", "Male", "Female"]:
+        raise RowError(UNKNOWN_GENDER, "Encountered unknown gender: " + gender)
+    return gender
+
+
+# The birth years that fit in the birthyear column of a TripStore
+BIRTHYEAR_MIN = -2 ** 15
+BIRTHYEAR_MAX = 2 ** 15 - 1
+
+
+def parse_trip_birthyear(row):
+    """
+    Parse the birth year from a row of the trips CSV file (0 unless
+    the user is a subscriber who gave it).
+
+    Raises: RowError if the birth year does not fit in a TripStore
+    """
+    if row[9] != "Subscriber" or len(row[11]) == 0:
+        return 0
+    birthyear = int(row[11])
+    if not BIRTHYEAR_MIN <= birthyear <= BIRTHYEAR_MAX:
+        raise RowError(BAD_VALUE,
+                       "Birth year out of range: " + str(birthyear))
+    return birthyear
+
+
+# Functions that parse each column from a row of the trips CSV file,
+# for when only some columns are needed (see parse_trip_fields, which
+# parses all of them)
+TRIP_COLUMN_PARSERS = {
+    "trip_id": lambda row, index, parse_time: int(row[0]),
+    "start": lambda row, index, parse_time: parse_time(row[1]),
+    "stop": lambda row, index, parse_time: parse_time(row[2]),
+    "bikeid": lambda row, index, parse_time: int(row[3]),
+    "tripduration": lambda row, index, parse_time: int(row[4]),
+    "from_idx": lambda row, index, parse_time: parse_trip_station(row[5],
+                                                                  index),
+    "to_idx": lambda row, index, parse_time: parse_trip_station(row[7],
+                                                                index),
+    "usertype": lambda row, index, parse_time: row[9],
+    "gender": lambda row, index, parse_time: parse_trip_gender(row),
+    "birthyear": lambda row, index, parse_time: parse_trip_birthyear(row),
+}
+
+
+def parse_trip_columns(row, station_index, parse_time, positions):
+    """
+    Parse some of the fields of a line from the trips CSV file. Only
+    the requested fields are parsed (and checked for errors).
+
+    Args:
+    - row, station_index, parse_time: See parse_trip_fields
+    - positions: (list of (integer, string) tuples) The position of
+      each requested field in the result, and the name of its column
+
+    Returns: (tuple) The trip fields, as in parse_trip_fields, with
+      None for the fields that were not requested.
+
+    Raises: RowError if one of the requested fields could not be parsed
+    """
+    fields = [None] * len(TripStore.COLUMNS)
+
+    try:
+        for position, name in positions:
+            fields[position] = TRIP_COLUMN_PARSERS[name](row, station_index,
+                                                         parse_time)
+    except RowError:
+        raise
+    except IndexError:
+        raise RowError(SHORT_ROW, "Missing fields in line") from None
+    except ValueError as e:
+        raise RowError(BAD_VALUE, "Error in parsing line: " + str(e)) from None
+
+    return tuple(fields)
+
+
+# Position of the last field of a trips file row that is needed to
+# parse each column (gender and birthyear also need the usertype)
+TRIP_COLUMN_FIELDS = {"trip_id": 0, "start": 1, "stop": 2, "bikeid": 3,
+                      "tripduration": 4, "from_idx": 5, "to_idx": 7,
+                      "usertype": 9, "gender": 10, "birthyear": 11}
+
+
+class TripQuery:
+    """
+    Describes which part of a trips file to load: the columns that
+    are needed, and conditions on the trips.
+
+    Lines are only split up to the last field that is needed (see
+    tokenize), the conditions are checked on each row before the
+    rest of it is parsed, so rows that do not satisfy them cost very
+    little, and only the requested columns are parsed. Note that the
+    rows are only checked for errors in the fields that are actually
+    parsed, and that most statistics need several columns (for
+    example, get_bike_times needs bikeid and tripduration).
+    """
+
+    def __init__(self, columns=None, usertypes=None, start=None, end=None,
+                 stations=None):
+        """
+        Constructor.
+
+        Args:
+        - columns: (list of strings) The names of the columns to load
+          (see TripStore.COLUMNS). By default, all of them.
+        - usertypes: (list of strings) Only load trips by these types
+          of user (e.g., ["Subscriber"])
+        - start, end: (integer or string) Only load trips that start
+          at or after start and before end, given as seconds since the
+          epoch or as Divvy timestamps (e.g., "2013-07-01 00:00")
+        - stations: (list of integers) Only load trips from or to one
+          of the stations with these IDs
+
+        Raises: ValueError if columns is empty or has unknown names
+        """
+        if columns is not None:
+            unknown = set(columns) - set(TRIP_COLUMN_FIELDS)
+            if unknown:
+                raise ValueError("Unknown trip columns: {}".format(
+                    ", ".join(sorted(unknown))))
+            if not columns:
+                raise ValueError("A TripQuery needs at least one column "
+                                 "(or None for all of them)")
+
+        self.columns = None if columns is None else frozenset(columns)
+        self.usertypes = None if usertypes is None else frozenset(usertypes)
+        self.start = None if start is None else TimeIndex.to_epoch(start)
+        self.end = None if end is None else TimeIndex.to_epoch(end)
+        self.stations = None if stations is None else frozenset(stations)
+
+        # The last field of the rows that is needed
+        fields = [TRIP_COLUMN_FIELDS[name]
+                  for name in (self.columns or TRIP_COLUMN_FIELDS)]
+        if self.usertypes is not None:
+            fields.append(TRIP_COLUMN_FIELDS["usertype"])
+        if self.stations is not None:
+            fields.append(TRIP_COLUMN_FIELDS["to_idx"])
+        if self.start is not None or self.end is not None:
+            fields.append(TRIP_COLUMN_FIELDS["start"])
+        self.last_field = max(fields, default=0)
+
+        # The requested columns and their positions in the trip fields
+        self.positions = [(position, name) for position, (name, _)
+                          in enumerate(TripStore.COLUMNS)
+                          if self.columns is None or name in self.columns]
+
+    def tokenize(self, lines):
+        """
+        Splits the lines of a trips file into rows of fields, like
+        csv.reader, but only up to the last field needed by the query:
+        the rest of each line is left in one more field, unparsed.
+        Lines with quoted fields (such as station names with commas)
+        are handed to csv.reader.
+
+        Args:
+        - lines: (iterable of strings) The lines
+
+        Returns: (generator of lists of strings) The rows
+        """
+        n = self.last_field + 1
+        for line in lines:
+            if '"' in line:
+                yield next(csv.reader([line]))
+                continue
+
+            line = line.rstrip("\r\n")
+            yield line.split(",", n) if line else []
+
+    def parse(self, row, station_index, parse_time):
+        """
+        Parse a line from the trips CSV file, if it satisfies the
+        conditions of the query.
+
+        Args:
+        - row, station_index, parse_time: See parse_trip_fields
+
+        Returns: (tuple) The trip fields (see parse_trip_columns), or
+          None if the trip does not satisfy the conditions.
+
+        Raises: RowError if the row could not be parsed
+        """
+        try:
+            if self.usertypes is not None and row[9] not in self.usertypes:
+                return None
+
+            if self.stations is not None and \
+               int(row[5]) not in self.stations and \
+               int(row[7]) not in self.stations:
+                return None
+
+            if self.start is not None or self.end is not None:
+                starttime = parse_time(row[1])
+                if self.start is not None and starttime < self.start:
+                    return None
+                if self.end is not None and starttime >= self.end:
+                    return None
+        except IndexError:
+            raise RowError(SHORT_ROW, "Missing fields in line") from None
+        except ValueError as e:
+            raise RowError(BAD_VALUE,
+                           "Error in parsing line: " + str(e)) from None
+
+        if self.columns is None:
+            return parse_trip_fields(row, station_index, parse_time)
+        return parse_trip_columns(row, station_index, parse_time,
+                                  self.positions)
+
+
+def parse_station_fields(row):
+    """
+    Parse a line from the stations CSV file.
+
+    Args:
+    - row: (list of strings) Values in a single row of the
+      stations CSV file
+
+    Returns: (tuple) The arguments for the DivvyStation constructor
+
+    Raises: RowError if the row could not be parsed
+    """
+    if len(row) < 7:
+        raise RowError(SHORT_ROW, "Error in parsing line: " + ",".join(row))
+
+    try:
+        station_id = int(row[0])
+        name = row[1]
+
+        latitude = float(row[2])
+        longitude = float(row[3])
+
+        dpcapacity = int(row[4])
+        landmark = int(row[5])
+
+        date = time.strptime(row[6], "%m/%d/%Y")
+    except ValueError as e:
+        raise RowError(BAD_VALUE, "Error in parsing data: " + str(e)) from None
+
+    return (station_id, name, latitude, longitude, dpcapacity,
+            landmark, date)
+
+
+ERROR_POLICIES = ("strict", "skip", "quarantine")
+
+
+class RejectedRows:
+    """
+    Collects the rows that could not be parsed while reading Divvy
+    files, according to an error policy:
+
+    - "strict": the first bad row raises a DivvyDataError
+    - "skip": bad rows are skipped; only the number of rows rejected
+      for each reason is kept
+    - "quarantine": like "skip", but the rejected rows are also kept,
+      with their reason, and saved to a CSV file by save(). The first
+      save() replaces the file, so that it only holds the rows
+      rejected while loading one dataset.
+
+    Rejecting a row does no I/O, so reading a file with bad rows
+    is as fast as reading one without them.
+    """
+
+    def __init__(self, policy="strict", filename=None):
+        """
+        Constructor.
+
+        Args:
+        - policy: (string) One of the ERROR_POLICIES
+        - filename: (string) Path of the file where save() writes
+          the quarantined rows
+        """
+        if policy not in ERROR_POLICIES:
+            raise ValueError("Unknown error policy: " + str(policy))
+
+        self.policy = policy
+        self.filename = filename
+        self.counts = {}
+        self.rows = []
+        # Whether the file has been written (or already holds the
+        # rejected rows, see DivvyData.load_snapshot)
+        self.saved = False
+
+    def reject(self, source, error, row):
+        """
+        Records a row that could not be parsed.
+
+        Args:
+        - source: (string) The kind of file ("stations" or "trips")
+        - error: (RowError) The error raised by the parser
+        - row: (list of strings) The row
+        """
+        if self.policy == "strict":
+            raise DivvyDataError("Error reading {}: {} ({})".format(
+                source, ",".join(row), error))
+
+        key = (source, error.reason)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if self.policy == "quarantine":
+            self.rows.append([source, error.reason] + row)
+
+    def merge(self, other):
+        """Adds the rows rejected by another RejectedRows object"""
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.rows.extend(other.rows)
+
+    def total(self):
+        """Returns the number of rejected rows"""
+        return sum(self.counts.values())
+
+    def save(self):
+        """
+        Writes the quarantined rows to the quarantine file (as CSV
+        rows: source, reason, then the fields of the rejected row)
+        and clears them from memory. The first call replaces any
+        file left by a previous load; later calls (see
+        DivvyData.append_trips) append to it.
+        """
+        if self.policy != "quarantine" or not self.filename:
+            return
+        if self.saved and not self.rows:
+            return
+
+        with open(self.filename, "a" if self.saved else "w",
+                  newline="") as f:
+            csv.writer(f).writerows(self.rows)
+        self.rows = []
+        self.saved = True
+
+
+# Suffixes of the files that DivvyData writes next to a trips file
+REJECTED_SUFFIX = ".rejected.csv"
+SNAPSHOT_SUFFIX = ".snapshot"
+
+
+def expand_trip_files(patterns):
+    """
+    Expands the trip files given to DivvyData: a path or glob pattern,
+    or a list of them. The files matching a pattern are sorted by name
+    (which puts monthly or quarterly Divvy files in order). Files
+    written by DivvyData itself (rejected rows and snapshots) never
+    match.
+
+    Args:
+    - patterns: (string or list of strings) Paths or glob patterns
+
+    Returns: (list of strings) The paths of the files. A pattern that
+      matches no files is kept as is, so that opening it fails.
+    """
+    if isinstance(patterns, str):
+        patterns = [patterns]
+
+    filenames = []
+    for pattern in patterns:
+        matches = [name for name in sorted(glob.glob(pattern))
+                   if os.path.isfile(name)
+                   and not name.endswith(REJECTED_SUFFIX)]
+        filenames.extend(matches or [pattern])
+    return filenames
+
+
+def open_trips_file(filename):
+    """
+    Opens a trips file for reading as text. Files ending in ".gz"
+    are decompressed while they are read.
+
+    Args:
+    - filename: (string) Path to trips file
+
+    Returns: (file object) The open file
+    """
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rt")
+    return open(filename)
+
+
+def find_chunks(filename, n):
+    """
+    Splits a CSV file into byte ranges that start and end on line
+    boundaries. The header row is not included in any range.
+
+    Note: this assumes that no quoted field contains a newline,
+    which is the case for the Divvy files.
+
+    Args:
+    - filename: (string) Path of the file
+    - n: (integer) The (maximum) number of ranges
+
+    Returns: (list of (integer, integer) tuples) The start and end
+      offsets of each range, in file order
+    """
+    with open(filename, "rb") as f:
+        f.readline()
+        start = f.tell()
+        size = os.fstat(f.fileno()).st_size
+
+        boundaries = [start]
+        for k in range(1, n):
+            offset = start + (size - start) * k // n
+            if offset <= boundaries[-1]:
+                continue
+            f.seek(offset)
+            f.readline()
+            if f.tell() < size and f.tell() > boundaries[-1]:
+                boundaries.append(f.tell())
+        boundaries.append(size)
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def read_trips_chunk(filename, start, end, station_index, time_parser,
+                     policy, query=None):
+    """
+    Reads the trips in a byte range of a trips file. This is the
+    work done by each process when the file is read in parallel,
+    so it only needs the station index (not the stations).
+
+    Args:
+    - filename: (string) Path to trips file
+    - start, end: (integers) The byte range (see find_chunks)
+    - station_index: (dictionary: integer -> integer) Maps station
+      identifiers to station indices
+    - time_parser: (string) The name of one of the TIME_PARSERS
+    - policy: (string) The error policy (see RejectedRows)
+    - query: (TripQuery) The columns and trips to load (optional)
+
+    Returns: (TripStore, RejectedRows) A TripStore (with no stations)
+      with the trips in the range, and the rows that were rejected
+    """
+    with open(filename, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    text = data.decode(locale.getpreferredencoding(False))
+
+    return read_trip_rows(tokenize_trips(io.StringIO(text), query),
+                          station_index, time_parser, policy, query)
+
+
+def read_trips_whole_file(filename, station_index, time_parser, policy,
+                          query=None):
+    """
+    Reads all the trips in a (possibly compressed) trips file. This is
+    the work done by each process when several files are read in
+    parallel.
+
+    Args:
+    - filename: (string) Path to trips file
+    - station_index, time_parser, policy, query: See read_trips_chunk
+
+    Returns: (TripStore, RejectedRows) See read_trips_chunk
+    """
+    with open_trips_file(filename) as f:
+        reader = tokenize_trips(f, query)
+        # read the header row.
+        next(reader)
+        return read_trip_rows(reader, station_index, time_parser, policy,
+                              query)
+
+
+def tokenize_trips(lines, query=None):
+    """
+    Splits the lines of a trips file into rows of fields.
+
+    Args:
+    - lines: (iterable of strings) The lines (such as an open file)
+    - query: (TripQuery) The query the rows are read for (optional),
+      which may not need all the fields (see TripQuery.tokenize)
+
+    Returns: (iterator of lists of strings) The rows
+    """
+    if query is None:
+        return csv.reader(lines)
+    return query.tokenize(lines)
+
+
+def read_trip_rows(rows, station_index, time_parser, policy, query=None):
+    """
+    Parses trips file rows into a TripStore (with no stations).
+
+    Args:
+    - rows: (iterable of lists of strings) The rows
+    - station_index, time_parser, policy, query: See read_trips_chunk
+
+    Returns: (TripStore, RejectedRows) See read_trips_chunk
+    """
+    parse_time = TIME_PARSERS[time_parser]
+    trips = TripStore(None, query and query.columns)
+    rejected = RejectedRows(policy)
+    parse = query.parse if query else parse_trip_fields
+
+    for row in rows:
+        try:
+            fields = parse(row, station_index, parse_time)
+        except RowError as e:
+            rejected.reject("trips", e, row)
+            continue
+        if fields is not None:
+            trips.append(fields)
+
+    return trips, rejected
+
+
+# Positions of the fields in a trip tuple (see TripStore.COLUMNS)
+(TRIP_ID, START, STOP, BIKEID, TRIPDURATION, FROM_IDX, TO_IDX,
+ USERTYPE, GENDER, BIRTHYEAR) = range(len(TripStore.COLUMNS))
+
+
+def merge_trip_stores(stations, stores, columns=None):
+    """
+    Merges TripStores, each sorted by start time, into a single
+    TripStore sorted by start time. Trips that start at the same
+    time (minute) are ordered by trip ID, as in the Divvy files.
+
+    When the stores do not overlap in time (as with Divvy's monthly
+    or quarterly files) they are simply concatenated; otherwise the
+    trips are merged with a k-way merge.
+
+    Args:
+    - stations: (list of DivvyStation) The stations of the result
+    - stores: (list of TripStore) The stores to merge
+    - columns: (list of strings) The columns of the stores (by
+      default, all of TripStore.COLUMNS). Without the start column,
+      the stores are concatenated in the given order.
+
+    Returns: (TripStore) The merged trips
+    """
+    merged = TripStore(stations, columns)
+    if merged.start is None:
+        for store in stores:
+            merged.extend(store)
+        return merged
+
+    keys = [name for name in ("start", "trip_id") if name in merged.columns]
+    positions = [START, TRIP_ID][:len(keys)]
+
+    def first(store):
+        return tuple(getattr(store, name)[0] for name in keys)
+
+    def last(store):
+        return tuple(getattr(store, name)[-1] for name in keys)
+
+    stores = sorted((store for store in stores if len(store)), key=first)
+    if all(last(a) <= first(b) for a, b in zip(stores, stores[1:])):
+        for store in stores:
+            merged.extend(store)
+        return merged
+
+    for fields in heapq.merge(*[store.rows() for store in stores],
+                              key=operator.itemgetter(*positions)):
+        merged.append(fields)
+    return merged
+
+
+class RunningStats:
+    """
+    Mean and (population) standard deviation of a stream of numbers,
+    computed with Welford's algorithm, so the numbers do not need to
+    be kept in a list.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        """Adds a number to the stream"""
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def result(self):
+        """
+        Returns: (integer, float, float) the count, mean and
+          standard deviation of the numbers seen so far
+        """
+        if self.count == 0:
+            return (0, 0.0, 0.0)
+        return (self.count, self.mean, math.sqrt(self.m2 / self.count))
+
+
+class TripReport:
+    """
+    Computes the statistics reported by go() in a single pass over
+    the columns of a TripStore, and keeps them up to date as more
+    trips (in file order) are added with update_columns. This is the
+    one place where the statistics are computed: for a DivvyData with
+    its trips in memory (see compute_stats), in streaming mode (where
+    it is fed one batch of trips at a time, see stream_trips) and by
+    append_trips.
+
+    A report over some of the trip columns (see TripQuery) only
+    computes the statistics that those columns allow (see
+    STAT_COLUMNS).
+    """
+
+    # The trip columns that each statistic is computed from
+    STAT_COLUMNS = {"number_trips": (),
+                    "total_duration": ("tripduration",),
+                    "total_distance": ("from_idx", "to_idx"),
+                    "bikeids": ("bikeid",),
+                    "bike_times": ("bikeid", "tripduration"),
+                    "bike_movements": ("bikeid", "from_idx", "to_idx"),
+                    "capacity_diffs": ("bikeid", "from_idx", "to_idx")}
+
+    STATS = tuple(STAT_COLUMNS)
+
+    # All the trip columns that the statistics are computed from
+    COLUMNS = ("bikeid", "tripduration", "from_idx", "to_idx")
+
+    def __init__(self, data, columns=COLUMNS):
+        """
+        Constructor.
+
+        Args:
+        - data: (DivvyData) The dataset the trips belong to
+        - columns: (list of strings) The trip columns that are
+          available (by default, all of COLUMNS)
+        """
+        self.data = data
+        self.columns = tuple(name for name in TripReport.COLUMNS
+                             if name in columns)
+        # The statistics that can be computed from the columns
+        self.stats = tuple(name for name, needed
+                           in TripReport.STAT_COLUMNS.items()
+                           if all(c in self.columns for c in needed))
+
+        self.number_trips = 0
+        self.total_duration = 0.0
+        self.total_distance = 0.0
+        self.bike_times = {}
+        self.last_station = {}
+        self.movements = {}
+        self.cap_diffs = RunningStats()
+
+    def update_columns(self, trips):
+        """
+        Updates the statistics with all the trips in a TripStore.
+
+        Args:
+        - trips: (TripStore) The trips
+        """
+        # The columns that the report does not use are read as zeros
+        # (the statistics computed from them are not reported)
+        def column(name):
+            if name in self.columns:
+                return getattr(trips, name)
+            return itertools.repeat(0, len(trips))
+
+        if "total_distance" in self.stats:
+            matrix = self.data.get_distance_matrix()
+            n = matrix.n
+            distances = matrix.values
+            capacities = [s.dpcapacity for s in self.data.station_list]
+        else:
+            n = 0
+            distances = [0.0]
+            capacities = [0]
+        track_movements = "bike_movements" in self.stats
+
+        total_duration = self.total_duration
+        total_distance = self.total_distance
+        bike_times = self.bike_times
+        last_stations = self.last_station
+        movements = self.movements
+
+        for bikeid, tripduration, from_idx, to_idx in zip(
+                column("bikeid"), column("tripduration"),
+                column("from_idx"), column("to_idx")):
+            total_duration += tripduration
+            total_distance += distances[from_idx * n + to_idx]
+            bike_times[bikeid] = bike_times.get(bikeid, 0) + tripduration
+
+            if track_movements:
+                last_station = last_stations.get(bikeid)
+                if last_station is None:
+                    movements[bikeid] = []
+                elif last_station != from_idx:
+                    movements[bikeid].append((last_station, from_idx))
+                    self.cap_diffs.add(capacities[from_idx] -
+                                       capacities[last_station])
+                last_stations[bikeid] = to_idx
+
+        self.number_trips += len(trips)
+        self.total_duration = total_duration
+        self.total_distance = total_distance
+
+    def results(self):
+        """
+        Returns: (dictionary) The value of each statistic that the
+          report computes (see stats), for the trips seen so far
+        """
+        results = {"number_trips": self.number_trips,
+                   "total_duration": self.total_duration,
+                   "total_distance": self.total_distance,
+                   "bikeids": set(self.bike_times),
+                   "bike_times": dict(self.bike_times),
+                   "capacity_diffs": self.cap_diffs.result()}
+        if "bike_movements" in self.stats:
+            results["bike_movements"] = self.data.station_movements(
+                self.movements)
+        return {name: results[name] for name in self.stats}
+
+
+class BikeIndex:
+    """
+    Groups the trips in a TripStore by bike.
+
+    The index is a permutation of the trip positions, sorted by bike
+    identifier (and, within each bike, in the original order, which
+    is by start time), plus the offset in that permutation where the
+    trips of each bike begin:
+
+    - bikeids: The bike identifiers, in increasing order
+    - offsets: The trips of bikeids[k] are order[offsets[k]] to
+      order[offsets[k + 1] - 1]
+    - order: The permutation of trip positions
+    """
+
+    def __init__(self, trips):
+        """
+        Constructor.
+
+        Args:
+        - trips: (TripStore) The trips to index
+        """
+        bikeid = trips.bikeid
+        # sorted is stable, so each bike's trips stay in time order
+        self.order = array.array("q", sorted(range(len(trips)),
+                                             key=bikeid.__getitem__))
+
+        self.bikeids = array.array("q")
+        self.offsets = array.array("q")
+        previous = None
+        for position, i in enumerate(self.order):
+            if bikeid[i] != previous:
+                previous = bikeid[i]
+                self.bikeids.append(previous)
+                self.offsets.append(position)
+        self.offsets.append(len(self.order))
+
+        self.positions = {b: k for k, b in enumerate(self.bikeids)}
+
+    def trip_positions(self, bikeid):
+        """
+        Returns the positions in the TripStore of the trips of a bike,
+        in time order (an empty sequence for an unknown bike)
+        """
+        k = self.positions.get(bikeid)
+        if k is None:
+            return self.order[0:0]
+        return self.order[self.offsets[k]:self.offsets[k + 1]]
+
+    def groups(self):
+        """
+        Iterates over the bikes, as (bike identifier, start offset,
+        end offset) tuples
+        """
+        return zip(self.bikeids, self.offsets, self.offsets[1:])
+
+
 class DivvyData:
     """
     Encapsulates the entire Divvy dataset.
 
-    A DivvyData object has three attributes:
+    A DivvyData object has the following attributes:
     - stations: A dictionary mapping station IDs to DivvyStation objects
-    - trips: A list of DivvyTrip objects, in the same order in which they
-             appear in the trips file (sorted by trip start time)
+    - station_list: A list of the DivvyStation objects, in the same
+             order in which they appear in the stations file
+    - station_index: A dictionary mapping station IDs to positions
+             in station_list
+    - trips: A TripStore with the trips, in the same order in which they
+             appear in the trips file (sorted by trip start time).
+             With several trips files, the trips of all the files
+             are merged by start time.
+             It can be used like a list of DivvyTrip objects.
+    - trips_filenames: A list of the paths of the trips files
     - bikeids: A set of bike IDs in the dataset
+    - online_dates: A Categorical with the dates on which the stations
+             went online
+
+    The distances between stations are computed once, when they are
+    first needed (see get_distance_matrix), and cached on disk next
+    to the stations file.
     """
 
-    def __init__(self, stations_filename, trips_filename):
+    def __init__(self, stations_filename, trips_filename,
+                 cache_distances=True, time_parser="fast", workers=1,
+                 snapshot=False, streaming=False, errors="strict",
+                 instrumentation=None, query=None):
         """
         Constructor.
 
         Args:
         - stations_filename: (string) Path of Divvy stations file
-        - trips_filename: (string) Path of Divvy trips file
+        - trips_filename: (string or list of strings) Path of Divvy
+          trips file, or the paths or glob patterns (such as
+          "Divvy_Trips_*.csv.gz") of several trips files, each sorted
+          by start time. Files ending in ".gz" are decompressed.
+        - cache_distances: (boolean) Whether to save the station
+          distance matrix next to the stations file (and reuse a
+          previously saved one)
+        - time_parser: (string) How to parse the trip timestamps:
+          "fast" (default) or "strptime". Both produce the same
+          results; "strptime" is slower and is kept for validation.
+        - workers: (integer) The number of processes used to read
+          the trips files (see read_trips_files)
+        - snapshot: (boolean) Whether to keep a binary snapshot of the
+          parsed data in a ".snapshot" directory next to the (first)
+          trips file. If a snapshot exists, was saved with the same
+          errors policy, and the files have not changed since it was
+          saved, the data is loaded from it (memory-mapped) instead
+          of parsing the files.
+        - streaming: (boolean) If True, the trips are not kept in
+          memory: the trips file is read once and the statistics
+          (see TripReport) are computed while reading it. trips is
+          then None, and the workers and snapshot options are
+          ignored.
+        - errors: (string) What to do with rows that cannot be parsed
+          (see RejectedRows): "strict" (default) raises a
+          DivvyDataError, "skip" skips them, and "quarantine" also
+          appends them to a ".rejected.csv" file next to the (first)
+          trips file. The rejected rows are counted in self.rejected.
+        - instrumentation: (Instrumentation) Where to record timers and
+          counters for each stage. By default nothing is recorded.
+        - query: (TripQuery) Only load these columns and trips. In
+          streaming mode, the query cannot select columns, and
+          snapshots are not used with a query. With a query that
+          does not load bikeid, bikeids is None.
+        """
+
+        self.instrumentation = instrumentation or NO_INSTRUMENTATION
+        self.query = query
+        self.time_parser = time_parser
+        self.parse_time = TIME_PARSERS[time_parser]
+        self.stations_filename = stations_filename
+        self.cache_distances = cache_distances
+        self.distance_matrix = None
+        self.bike_index = None
+        self.spatial_index = None
+        self.time_index = None
+        self.flow_matrix = None
+        self.stats = {}
+        # The TripReport that computed the statistics in self.stats,
+        # which can be updated with more trips (see append_trips)
+        self.report = None
+        # The trips and rejected rows already recorded in the
+        # instrumentation counters (see finish_loading)
+        self.counted_trips = 0
+        self.counted_rejected = {}
+        self.trips_filenames = expand_trip_files(trips_filename)
+        first_filename = self.trips_filenames[0]
+        self.rejected = RejectedRows(errors, first_filename + REJECTED_SUFFIX)
+
+        if streaming:
+            if query is not None and query.columns is not None:
+                raise ValueError("Streaming mode needs all the trip columns")
+
+            with self.instrumentation.timer("read_stations"):
+                self.stations = DivvyData.read_stations_file(
+                    stations_filename, self.rejected)
+            self.index_stations()
+            self.trips = None
+
+            self.report = TripReport(self)
+            with self.instrumentation.timer("read_trips"):
+                self.stream_trips(self.trips_filenames)
+            self.bikeids = self.stats["bikeids"]
+            self.finish_loading()
+            return
+
+        snapshot_dirname = first_filename + SNAPSHOT_SUFFIX
+        sources = {"stations": stations_filename}
+        for i, filename in enumerate(self.trips_filenames):
+            sources["trips" if i == 0 else "trips{}".format(i + 1)] = filename
+
+        # A snapshot holds all the trips, not those selected by a query
+        snapshot = snapshot and query is None
+
+        if not (snapshot and self.load_snapshot(snapshot_dirname, sources)):
+            with self.instrumentation.timer("read_stations"):
+                self.stations = DivvyData.read_stations_file(
+                    stations_filename, self.rejected)
+            self.index_stations()
+
+            with self.instrumentation.timer("read_trips"):
+                self.trips = self.read_trips_files(self.trips_filenames,
+                                                   workers)
+
+            if snapshot:
+                self.save_snapshot(snapshot_dirname, sources)
+
+        self.bikeids = None
+        if self.trips.bikeid is not None:
+            self.bikeids = set(self.trips.bikeid)
+        self.finish_loading()
+
+    @instrumented
+    def append_trips(self, filename, workers=1):
+        """
+        Adds the trips in another trips file (for example, the next
+        month of Divvy data) to the dataset. Only the new file is
+        parsed, and the statistics computed so far are updated with
+        the new trips instead of being recomputed.
+
+        The trips in the new file should start after those already
+        in the dataset, so that bike movements between the last trip
+        of a bike in the old data and its first trip in the new file
+        are detected.
+
+        Args:
+        - filename: (string or list of strings) Path to trips file, or
+          paths or glob patterns of several files (see the constructor)
+        - workers: (integer) The number of processes used to read
+          the files (see read_trips_files)
+        """
+        filenames = expand_trip_files(filename)
+        self.trips_filenames.extend(filenames)
+
+        if self.trips is None:
+            # Streaming mode: just feed the new trips to the report
+            with self.instrumentation.timer("read_trips"):
+                self.stream_trips(filenames)
+            self.bikeids = self.stats["bikeids"]
+            self.finish_loading()
+            return
+
+        with self.instrumentation.timer("read_trips"):
+            new_trips = self.read_trips_files(filenames, workers)
+
+        # Statistics computed without a TripReport (such as a total
+        # distance computed on its own) can only be updated by one,
+        # so bring one up to date with the old trips first.
+        if self.report is None and \
+           any(name in self.stats for name in TripReport.STATS):
+            self.report = TripReport(self, self.trips.columns)
+            self.report.update_columns(self.trips)
+
+        self.trips.extend(new_trips)
+        if self.bikeids is not None:
+            self.bikeids.update(new_trips.bikeid)
+
+        if self.report is not None:
+            self.report.update_columns(new_trips)
+            self.stats.update(self.report.results())
+
+        if self.flow_matrix is not None:
+            self.flow_matrix.update_columns(new_trips)
+        self.bike_index = None
+        self.time_index = None
+
+        self.finish_loading()
+
+    def index_stations(self):
+        """
+        Builds station_list and station_index from the stations, and
+        makes stations that went online on the same day share a
+        single online_date object (see online_dates).
+        """
+        self.station_list = list(self.stations.values())
+        self.station_index = {station_id: i for i, station_id
+                              in enumerate(self.stations)}
+
+        self.online_dates = Categorical()
+        for station in self.station_list:
+            station.online_date = self.online_dates.intern(
+                station.online_date)
+
+    def finish_loading(self):
+        """
+        Saves the quarantined rows, if any, and records the number of
+        trip rows read and rejected since the last call (that is, by
+        the constructor or by append_trips) in the instrumentation
+        counters.
         """
+        self.rejected.save()
 
-        self.stations = DivvyData.read_stations_file(stations_filename)
-        self.trips = self.read_trips_file(trips_filename)
+        number_trips = self.get_number_trips()
+        trip_rows = number_trips - self.counted_trips
+        for (source, reason), count in self.rejected.counts.items():
+            new = count - self.counted_rejected.get((source, reason), 0)
+            self.instrumentation.count(
+                "rejected_{}_{}".format(source, reason), new)
+            if source == "trips":
+                trip_rows += new
+        self.instrumentation.count("trip_rows", trip_rows)
 
-        self.bikeids = set()
-        for t in self.trips:
-            self.bikeids.add(t.bikeid)
+        self.counted_trips = number_trips
+        self.counted_rejected = dict(self.rejected.counts)
 
     # A method that is useful for the class but does not use any
     # instance attributes or instance methods
@@ -239,59 +1808,65 @@ class DivvyData:
           stations CSV file
 
         Returns: DivvyStation object constructed with the values
-          in the provided row.
+          in the provided row, or None (after printing the error) if
+          the row could not be parsed.
         """
-
-        if len(row) < 7:
-            print("Error in parsing line: " + ",".join(row))
-            return None
-
         try:
-            station_id = int(row[0])
-            name = row[1]
-
-            latitude = float(row[2])
-            longitude = float(row[3])
-
-            dpcapacity = int(row[4])
-            landmark = int(row[5])
-
-            date = time.strptime(row[6], "%m/%d/%Y")
-        except ValueError as e:
-            print("Error in parsing data: " + str(e))
+            return DivvyStation(*parse_station_fields(row))
+        except RowError as e:
+            print(e)
             return None
 
-        return DivvyStation(station_id, name, latitude,
-                            longitude, dpcapacity, landmark, date)
-
     # A method that is useful for the class but does not use any
     # instance attributes or instance methods
     @staticmethod
-    def read_stations_file(filename):
+    def read_stations_file(filename, rejected=None):
         """
         Read a Divvy stations file.
 
         Args:
         - filename: (string) Path to station file
+        - rejected: (RejectedRows) Where to record the rows that cannot
+          be parsed (by default, the first one raises DivvyDataError)
 
         Returns: (dictionary: integer -> DivvyStation) A dictionary that
           maps station identifiers to DivvyStation objects
         """
+        if rejected is None:
+            rejected = RejectedRows()
+
         stations = {}
         with open(filename) as f:
             reader = csv.reader(f)
             # read the header row.
             next(reader)
             for row in reader:
-                station = DivvyData.read_single_station(row)
-                if not station:
-                    print("Error reading station: " + ",".join(row))
-                    sys.exit(0)
-                else:
-                    stations[station.station_id] = station
+                try:
+                    station = DivvyStation(*parse_station_fields(row))
+                except RowError as e:
+                    rejected.reject("stations", e, row)
+                    continue
+                stations[station.station_id] = station
 
         return stations
 
+    def parse_trip_row(self, row):
+        """
+        Parse a line from the trips CSV file into a tuple of
+        trip fields, without building any objects.
+
+        Args:
+        - row: (list of strings) Values in a single row of the
+          trips CSV file
+
+        Returns: (tuple) The trip fields, in the order given by
+          TripStore.COLUMNS. Times are seconds since the epoch and
+          stations are indices into station_list.
+
+        Raises: RowError if the row could not be parsed
+        """
+        return parse_trip_fields(row, self.station_index, self.parse_time)
+
     def read_single_trip(self, row):
         """
         Create a DivvyTrip object based on a line
@@ -302,101 +1877,507 @@ class DivvyData:
           trips CSV file
 
         Returns: DivvyTrip object constructed with the values
-          in the provided row.
+          in the provided row, or None (after printing the error) if
+          the row could not be parsed.
         """
-
         try:
-            trip_id = int(row[0])
+            fields = self.parse_trip_row(row)
+        except RowError as e:
+            print(e)
+            return None
 
-            starttime = time.strptime(row[1], "%Y-%m-%d %H:%M")
-            endtime = time.strptime(row[2], "%Y-%m-%d %H:%M")
+        (trip_id, starttime, endtime, bikeid, tripduration,
+         from_station, to_station, usertype, gender, birthyear) = fields
 
-            bikeid = int(row[3])
-            tripduration = int(row[4])
+        return DivvyTrip(trip_id, starttime, endtime, bikeid,
+                         tripduration, self.station_list[from_station],
+                         self.station_list[to_station],
+                         usertype, gender, birthyear)
 
-            station_id = int(row[5])
-            if station_id not in self.stations:
-                print("Encountered unknown station: " + str(station_id))
-                return None
-            from_station = self.stations[station_id]
-            # Skip the station name (row[6]). We do not use it.
+    def read_trips_files(self, filenames, workers=1):
+        """
+        Read several Divvy trips files, and merge their trips.
 
-            station_id = int(row[7])
-            if station_id not in self.stations:
-                print("Encountered unknown station: " + str(station_id))
-                return None
-            to_station = self.stations[station_id]
-            # Skip the station name (row[8]). We do not use it.
+        Args:
+        - filenames: (list of strings) Paths to trips files, each
+          sorted by start time
+        - workers: (integer) The number of processes used to read the
+          files. With more than one, up to that many files are read
+          (and decompressed) at the same time. A single file is read
+          as described in read_trips_file.
+
+        Returns: (TripStore) A columnar store with all the trips
+          in the files, sorted by start time (see merge_trip_stores).
+        """
+        if len(filenames) == 1:
+            return self.read_trips_file(filenames[0], workers)
+
+        if workers <= 1:
+            stores = [self.read_trips_file(filename)
+                      for filename in filenames]
+            return merge_trip_stores(self.station_list, stores,
+                                     self.trips_columns())
+
+        n = len(filenames)
+        stores = []
+        with concurrent.futures.ProcessPoolExecutor(min(workers, n)) as pool:
+            results = pool.map(read_trips_whole_file, filenames,
+                               [self.station_index] * n,
+                               [self.time_parser] * n,
+                               [self.rejected.policy] * n,
+                               [self.query] * n)
+            for store, rejected in results:
+                stores.append(store)
+                self.rejected.merge(rejected)
+
+        return merge_trip_stores(self.station_list, stores,
+                                 self.trips_columns())
+
+    def trips_columns(self):
+        """
+        Returns the names of the trip columns that are loaded, or None
+        if all of them are (see TripQuery).
+        """
+        if self.query is None:
+            return None
+        return self.query.columns
 
-            usertype = row[9]
-            gender = None
-            birthyear = 0
+    def read_trips_file(self, filename, workers=1):
+        """
+        Read a Divvy trips file.
 
-            if usertype == "Subscriber":
-                gender = row[10]
-                if gender not in ["", "Male", "Female"]:
-                    print("Encountered unknown gender: " + gender)
-                    return None
+        Args:
+        - filename: (string) Path to trips file
+        - workers: (integer) The number of processes used to read the
+          file. With more than one, the file is split into line-aligned
+          byte ranges that are parsed in a process pool and then merged
+          in file order. (Compressed files are always read by a single
+          process.)
+
+        Returns: (TripStore) A columnar store with all the trips
+          in the file.
+        """
+        if workers > 1 and not filename.endswith(".gz"):
+            return self.read_trips_file_parallel(filename, workers)
 
-                if len(row[11]) > 0:
-                    birthyear = int(row[11])
-        except ValueError as e:
-            print("Error in parsing line: " + str(e))
-            return None
+        trips = TripStore(self.station_list, self.trips_columns())
+        for fields in self.iter_trips_file(filename):
+            trips.append(fields)
 
-        return DivvyTrip(trip_id, starttime, endtime, bikeid,
-                         tripduration, from_station, to_station,
-                         usertype, gender, birthyear)
+        return trips
 
-    def read_trips_file(self, filename):
+    def iter_trips_file(self, filename):
         """
-        Read a Divvy trips file.
+        Read a Divvy trips file one row at a time.
 
         Args:
         - filename: (string) Path to trips file
 
-        Returns: (list of DivvyTrip) A list with all the trips in the file.
+        Returns: (generator of tuples) The fields of each trip (see
+          parse_trip_row), in file order. Rows that cannot be parsed
+          are handled according to self.rejected, and trips that do
+          not satisfy self.query are skipped.
         """
-        trips = []
-        with open(filename) as f:
-            reader = csv.reader(f)
+        parse = self.query.parse if self.query else parse_trip_fields
+        station_index = self.station_index
+        parse_time = self.parse_time
+        rejected = self.rejected
+        timer = self.instrumentation.timer
+
+        with open_trips_file(filename) as f:
+            reader = tokenize_trips(f, self.query)
             # read the header row.
             next(reader)
-            for row in reader:
-                trip = self.read_single_trip(row)
-                if not trip:
-                    print("Error reading trip: " + ",".join(row))
-                    sys.exit(0)
-                else:
-                    trips.append(trip)
+
+            # The rows are tokenized and parsed in batches, so that the
+            # time spent on each can be measured without timing every
+            # single row.
+            while True:
+                with timer("tokenize_trips"):
+                    rows = list(itertools.islice(reader, READ_BATCH_SIZE))
+                if not rows:
+                    break
+
+                batch = []
+                with timer("parse_trips"):
+                    for row in rows:
+                        try:
+                            fields = parse(row, station_index, parse_time)
+                        except RowError as e:
+                            rejected.reject("trips", e, row)
+                            continue
+                        if fields is not None:
+                            batch.append(fields)
+
+                yield from batch
+
+    def iter_trips_files(self, filenames):
+        """
+        Read several Divvy trips files one row at a time.
+
+        Args:
+        - filenames: (list of strings) Paths to trips files, each
+          sorted by start time
+
+        Returns: (generator of tuples) The fields of each trip (see
+          parse_trip_row), merged by start time (and trip ID, see
+          merge_trip_stores). Only one batch of rows of each file is
+          held in memory at a time.
+        """
+        if len(filenames) == 1:
+            return self.iter_trips_file(filenames[0])
+
+        return heapq.merge(*[self.iter_trips_file(filename)
+                             for filename in filenames],
+                           key=operator.itemgetter(START, TRIP_ID))
+
+    def read_trips_file_parallel(self, filename, workers):
+        """
+        Read a Divvy trips file using a pool of processes.
+
+        Args:
+        - filename: (string) Path to trips file
+        - workers: (integer) The number of processes
+
+        Returns: (TripStore) A columnar store with all the trips
+          in the file, in file order.
+        """
+        # Use a few chunks per worker, so that a slow chunk does not
+        # leave the other workers idle.
+        chunks = find_chunks(filename, workers * 4)
+
+        trips = TripStore(self.station_list, self.trips_columns())
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            results = pool.map(read_trips_chunk,
+                               [filename] * len(chunks),
+                               [start for start, _ in chunks],
+                               [end for _, end in chunks],
+                               [self.station_index] * len(chunks),
+                               [self.time_parser] * len(chunks),
+                               [self.rejected.policy] * len(chunks),
+                               [self.query] * len(chunks))
+            for chunk, rejected in results:
+                trips.extend(chunk)
+                self.rejected.merge(rejected)
 
         return trips
 
+    @instrumented
+    def save_snapshot(self, dirname, sources):
+        """
+        Saves the stations and trips in a snapshot directory: one raw
+        binary file per trip column, plus a JSON header with the
+        stations, the column types and a description of the source
+        files (see divvy_snapshot.write_snapshot).
+
+        Args:
+        - dirname: (string) Path of the snapshot directory
+        - sources: (dictionary: string -> string) Paths of the
+          files the data was read from
+
+        Returns: (boolean) True if the snapshot was saved
+        """
+        stations = [[s.station_id, s.name, s.location.latitude,
+                     s.location.longitude, s.dpcapacity, s.landmark,
+                     list(s.online_date)] for s in self.station_list]
+        header = {"stations": stations,
+                  "usertypes": self.trips.usertypes.values,
+                  "genders": self.trips.genders.values,
+                  "length": len(self.trips),
+                  "errors": self.rejected.policy,
+                  "rejected": [[source, reason, count] for (source, reason),
+                               count in self.rejected.counts.items()]}
+        columns = [(name, typecode, getattr(self.trips, name))
+                   for name, typecode in TripStore.COLUMNS]
+        return write_snapshot(dirname, header, sources, columns)
+
+    @instrumented
+    def load_snapshot(self, dirname, sources):
+        """
+        Loads the stations and trips from a snapshot directory saved
+        with save_snapshot. The trip columns are memory-mapped, not
+        copied, so loading takes (nearly) constant time.
+
+        Args:
+        - dirname: (string) Path of the snapshot directory
+        - sources: (dictionary: string -> string) Paths of the
+          files the data would otherwise be read from
+
+        Returns: (boolean) True if the snapshot was loaded, False if
+          there is no snapshot, if it is out of date, or if it was
+          saved under another error policy (see RejectedRows).
+        """
+        header = read_snapshot_header(dirname, sources, TripStore.COLUMNS)
+        if header is None or header.get("errors") != self.rejected.policy:
+            return False
+        columns = map_snapshot_columns(dirname, TripStore.COLUMNS,
+                                       header["length"])
+        if columns is None:
+            return False
+
+        self.stations = {}
+        for (station_id, name, latitude, longitude, dpcapacity, landmark,
+             online_date) in header["stations"]:
+            self.stations[station_id] = DivvyStation(
+                station_id, name, latitude, longitude, dpcapacity,
+                landmark, time.struct_time(online_date))
+        self.index_stations()
+
+        trips = TripStore(self.station_list)
+        for name, column in columns.items():
+            setattr(trips, name, column)
+
+        trips.usertypes = Categorical(header["usertypes"])
+        trips.genders = Categorical(header["genders"])
+
+        for source, reason, count in header["rejected"]:
+            self.rejected.counts[(source, reason)] = count
+        # The quarantine file (if any) was written when the snapshot
+        # was saved, so keep it
+        self.rejected.saved = True
+
+        self.trips = trips
+        return True
+
+    def stream_trips(self, filenames):
+        """
+        Feeds the trips in some files to self.report, one batch of
+        READ_BATCH_SIZE trips at a time (see iter_trips_files), and
+        saves its results in self.stats.
+
+        Args:
+        - filenames: (list of strings) Paths to trips files
+        """
+        rows = self.iter_trips_files(filenames)
+        while True:
+            batch = TripStore(self.station_list, TripReport.COLUMNS)
+            for row in itertools.islice(rows, READ_BATCH_SIZE):
+                batch.append(row)
+            if len(batch) == 0:
+                break
+            self.report.update_columns(batch)
+
+        self.stats.update(self.report.results())
+
+    def update_report(self):
+        """
+        Computes all the statistics that the loaded trip columns allow
+        (see TripReport) in a single pass over the trips, and saves
+        them in self.stats. The report is kept, so that append_trips
+        can update the statistics.
+        """
+        self.report = TripReport(self, self.trips.columns)
+        self.report.update_columns(self.trips)
+        self.stats.update(self.report.results())
+
+    @instrumented
+    def require_columns(self, names, needed_by):
+        """
+        Checks that the trips were loaded with some columns (see
+        TripQuery).
+
+        Args:
+        - names: (list of strings) The names of the columns
+        - needed_by: (string) What needs them, for the error message
+
+        Raises: ValueError if some of the columns were not loaded
+        """
+        if self.trips is None:
+            # Streaming mode reads all the columns
+            return
+        missing = [name for name in names if name not in self.trips.columns]
+        if missing:
+            raise ValueError("{} needs the trip columns {}, which were not "
+                             "loaded (see TripQuery)".format(
+                                 needed_by, ", ".join(missing)))
+
+    def compute_stats(self):
+        """
+        Computes all the statistics reported by go() in a single pass
+        over the trips (see TripReport). Statistics that have already
+        been computed are not computed again, and the get_* methods
+        return the saved results.
+
+        Returns: (dictionary) self.stats
+        """
+        if any(name not in self.stats for name in TripReport.STATS):
+            self.require_columns(TripReport.COLUMNS, "compute_stats")
+            self.update_report()
+
+        return self.stats
+
     def get_number_stations(self):
         """Returns the number of stations in the dataset"""
         return len(self.stations)
 
     def get_number_trips(self):
         """Returns the number of trips in the dataset"""
+        if "number_trips" in self.stats:
+            return self.stats["number_trips"]
+
         return len(self.trips)
 
+    @instrumented
+    def get_distance_matrix(self):
+        """
+        Returns the DistanceMatrix for the stations in the dataset.
+
+        The matrix is computed the first time it is needed. If
+        cache_distances is set, it is loaded from (or saved to) a
+        ".distances" file next to the stations file, which is only
+        reused if the stations file has not changed since.
+        """
+        if self.distance_matrix is not None:
+            return self.distance_matrix
+
+        n = len(self.station_list)
+        matrix = None
+        if self.cache_distances:
+            cache_filename = self.stations_filename + ".distances"
+            digest = file_digest(self.stations_filename)
+            matrix = DistanceMatrix.load(cache_filename, digest, n)
+
+        if matrix is None:
+            matrix = DistanceMatrix.build(self.station_list)
+            if self.cache_distances:
+                matrix.save(cache_filename, digest)
+
+        self.distance_matrix = matrix
+        return matrix
+
+    def get_trip_distances(self):
+        """
+        Computes the distance (in meters) of every trip, by looking up
+        each (origin, destination) pair in the station distance matrix.
+
+        Returns: (sequence of floats) The distance of each trip, in the
+          same order as self.trips
+        """
+        self.require_columns(["from_idx", "to_idx"], "get_trip_distances")
+        matrix = self.get_distance_matrix()
+        n = matrix.n
+
+        if np is not None:
+            values = np.frombuffer(matrix.values, dtype=np.float64)
+            from_idx = np.asarray(self.trips.from_idx, dtype=np.int64)
+            to_idx = np.asarray(self.trips.to_idx, dtype=np.int64)
+            return values[from_idx * n + to_idx]
+
+        values = matrix.values
+        return array.array("d", [values[f * n + t] for f, t
+                                 in zip(self.trips.from_idx,
+                                        self.trips.to_idx)])
+
+    @instrumented
     def get_total_distance(self):
         """Returns the total distance of all the Divvy trips"""
-        total_distance = 0.0
-        for trip in self.trips:
-            total_distance += trip.get_distance()
+        if "total_distance" in self.stats:
+            return self.stats["total_distance"]
+
+        # Add up the distances without a Python loop over the trips:
+        # in NumPy when get_trip_distances returns a NumPy array
+        distances = self.get_trip_distances()
+        if np is not None:
+            total_distance = np.sum(distances)
+        else:
+            total_distance = math.fsum(distances)
 
-        return total_distance
+        self.stats["total_distance"] = float(total_distance)
+        return self.stats["total_distance"]
 
+    @instrumented
     def get_total_duration(self):
         """Computes the total duration, in seconds, of all the Divvy trips"""
+        if "total_duration" in self.stats:
+            return self.stats["total_duration"]
+
+        self.require_columns(["tripduration"], "get_total_duration")
         total_duration = 0.0
 
-        for trip in self.trips:
-            total_duration += trip.tripduration
+        for tripduration in self.trips.tripduration:
+            total_duration += tripduration
 
+        self.stats["total_duration"] = total_duration
         return total_duration
 
+    @instrumented
+    def get_spatial_index(self):
+        """
+        Returns the SpatialIndex of the stations, which is built the
+        first time it is needed.
+        """
+        if self.spatial_index is None:
+            self.spatial_index = SpatialIndex(self.station_list)
+
+        return self.spatial_index
+
+    @instrumented
+    def get_flow_matrix(self):
+        """
+        Returns the FlowMatrix of the trips, which is built the first
+        time it is needed.
+        """
+        if self.flow_matrix is None:
+            self.require_columns(["from_idx", "to_idx", "tripduration"],
+                                 "get_flow_matrix")
+            self.flow_matrix = FlowMatrix(len(self.station_list))
+            self.flow_matrix.update_columns(self.trips)
+
+        return self.flow_matrix
+
+    def get_station_flows(self):
+        """
+        Computes the trips into and out of each station.
+
+        Returns: (dictionary) Maps each DivvyStation to an
+          (inflow, outflow, net imbalance) tuple
+        """
+        matrix = self.get_flow_matrix()
+        inflow = matrix.inflow()
+        outflow = matrix.outflow()
+        return {station: (inflow[i], outflow[i], inflow[i] - outflow[i])
+                for i, station in enumerate(self.station_list)}
+
+    @instrumented
+    def get_time_index(self):
+        """
+        Returns the TimeIndex of the trips, which is built the first
+        time it is needed.
+        """
+        if self.time_index is None:
+            self.require_columns(["start"], "get_time_index")
+            self.time_index = TimeIndex(self.trips)
+
+        return self.time_index
+
+    def get_trips_between(self, start, end):
+        """
+        Returns: (TripStore) A zero-copy slice with the trips that
+          start in a time range (see TimeIndex.between)
+        """
+        return self.get_time_index().between(start, end)
+
+    @instrumented
+    def get_bike_index(self):
+        """
+        Returns the BikeIndex of the trips, which is built the first
+        time it is needed.
+        """
+        if self.bike_index is None:
+            self.require_columns(["bikeid"], "get_bike_index")
+            self.bike_index = BikeIndex(self.trips)
+
+        return self.bike_index
+
+    def get_bike_trips(self, bikeid):
+        """
+        Returns: (list of DivvyTrip) The trips taken by a bike,
+          in time order
+        """
+        return [self.trips[i]
+                for i in self.get_bike_index().trip_positions(bikeid)]
+
+    @instrumented
     def get_bike_times(self):
         """
         Computes, for every bike in the Divvy dataset, the sum of the
@@ -405,13 +2386,15 @@ class DivvyData:
         Returns a dictionary mapping bike identifiers (integer) to
         a duration in seconds (integer)
         """
+        if "bike_times" not in self.stats:
+            self.require_columns(TripReport.STAT_COLUMNS["bike_times"],
+                                 "get_bike_times")
+            self.update_report()
 
-        # YOUR CODE HERE
-
-        # Replace {} with the correct return value
-        return {}
+        return self.stats["bike_times"]
 
 
+    @instrumented
     def get_bike_movements(self):
         """
         Returns a dictionary mapping bike identifiers (integer)
@@ -430,16 +2413,74 @@ class DivvyData:
         the bikes that have not been moved at all (those entries
         will just map to an empty list)
         """
+        if "bike_movements" not in self.stats:
+            self.require_columns(TripReport.STAT_COLUMNS["bike_movements"],
+                                 "get_bike_movements")
+            self.update_report()
+
+        return self.stats["bike_movements"]
+
+    def station_movements(self, movements):
+        """
+        Converts bike movements between station indices into the
+        format returned by get_bike_movements.
 
-        # YOUR CODE HERE
+        Args:
+        - movements: (dictionary) Maps bike identifiers to lists of
+          (from station index, to station index) tuples
+
+        Returns: (dictionary) Maps bike identifiers to lists of
+          (from station, to station, capacity difference) tuples
+        """
+        stations = self.station_list
+        station_movements = {}
+        for bikeid, moves in movements.items():
+            station_movements[bikeid] = []
+            for from_idx, to_idx in moves:
+                from_station = stations[from_idx]
+                to_station = stations[to_idx]
+                station_movements[bikeid].append(
+                    (from_station, to_station,
+                     to_station.dpcapacity - from_station.dpcapacity))
+        return station_movements
+
+    @instrumented
+    def get_capacity_diff_stats(self):
+        """
+        Computes statistics about the capacity differences of the bike
+        movements (see get_bike_movements), without building a list
+        of the differences.
 
-        # Replace {} with the correct return value
-        return {}
+        Returns: (integer, float, float) the number of movements, and
+          the mean and standard deviation of the capacity differences
+        """
+        if "capacity_diffs" not in self.stats:
+            self.require_columns(TripReport.STAT_COLUMNS["capacity_diffs"],
+                                 "get_capacity_diff_stats")
+            self.update_report()
+
+        return self.stats["capacity_diffs"]
 
+    @instrumented
+    def get_segment_stats(self, keys=("usertype", "gender")):
+        """
+        Breaks the trips down by the values of some categorical columns
+        (see TripStore.categories), by counting over their codes.
+
+        Args:
+        - keys: (list of strings) The names of the columns
+
+        Returns: (dictionary) Maps tuples of column values (e.g.,
+          ("Subscriber", "Female")) to (number of trips, total
+          duration) tuples
+        """
+        self.require_columns(list(keys) + ["tripduration"],
+                             "get_segment_stats")
+        counts = self.trips.count_by(keys)
+        durations = self.trips.sum_by(keys, "tripduration")
+        return {group: (counts[group], durations[group])
+                for group in counts}
 
-MINUTE = 60
-HOUR = 60 * MINUTE
-DAY = 24 * HOUR
 
 def time_str(t):
     """
@@ -464,11 +2505,24 @@ def time_str(t):
     return "{}d {}h {}m {}s".format(days, hours, minutes, seconds)
 
 
-def go(station_filename, trip_filename):
+def go(station_filename, trip_filename, instrumentation=None, workers=1):
     """
     Print some statistics about the Divvy files.
+
+    Args:
+    - station_filename: (string) Path of Divvy stations file
+    - trip_filename: (string or list of strings) Path of Divvy trips
+      file, or paths or glob patterns of several trips files
+    - instrumentation: (Instrumentation) Where to record timers and
+      counters for each stage (optional)
+    - workers: (integer) The number of processes used to read the
+      trips files
     """
-    data = DivvyData(station_filename, trip_filename)
+    data = DivvyData(station_filename, trip_filename,
+                     instrumentation=instrumentation, workers=workers)
+
+    # Compute all the statistics in one pass over the trips
+    data.compute_stats()
 
     # Number of stations and trips
     print("# of stations:", data.get_number_stations())
@@ -517,13 +2571,7 @@ def go(station_filename, trip_filename):
     s = "The average number of times a bike was moved was {:.2f}"
     print(s.format(avg_moves))
 
-    cap_diffs = []
-    for movs in bm.values():
-        for _, _, cap_diff in movs:
-            cap_diffs.append(cap_diff)
-    avg_cap_diff = sum(cap_diffs) / len(cap_diffs)
-    tmp = sum([(c-avg_cap_diff)**2 for c in cap_diffs])
-    stdev_cap_diff = math.sqrt(tmp / len(cap_diffs))
+    _, avg_cap_diff, stdev_cap_diff = data.get_capacity_diff_stats()
 
     if avg_cap_diff > 0:
         cap_str = "{:.2f} more".format(avg_cap_diff)
@@ -537,11 +2585,41 @@ def go(station_filename, trip_filename):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) == 3:
-        station_filename_arg = sys.argv[1]
-        trip_filename_arg = sys.argv[2]
-    else:
-        print("usage: python {} <stationFile> <tripFile>".format(sys.argv[0]))
-        sys.exit(0)
-
-    go(station_filename_arg, trip_filename_arg)
+    parser = argparse.ArgumentParser(
+        description="Print some statistics about the Divvy files.")
+    parser.add_argument("station_file")
+    parser.add_argument("trip_files", nargs="+", metavar="trip_file",
+                        help="Divvy trips file, or glob pattern (such as "
+                        "'Divvy_Trips_*.csv.gz'); files ending in .gz are "
+                        "decompressed")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes used to read the trips "
+                        "files (default: 1)")
+    parser.add_argument("--report", metavar="FILE",
+                        help="write timers and counters for each stage "
+                        "of the pipeline to FILE, as JSON")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="run under cProfile and save the profile to "
+                        "FILE (for pstats, snakeviz, flameprof, ...)")
+    cli_args = parser.parse_args()
+
+    instrumentation_arg = Instrumentation() if cli_args.report else None
+    profiler = cProfile.Profile() if cli_args.profile else None
+
+    try:
+        if profiler:
+            profiler.runcall(go, cli_args.station_file,
+                             cli_args.trip_files, instrumentation_arg,
+                             cli_args.workers)
+        else:
+            go(cli_args.station_file, cli_args.trip_files,
+               instrumentation_arg, cli_args.workers)
+    except DivvyDataError as e:
+        print(e)
+        sys.exit(1)
+
+    if profiler:
+        profiler.dump_stats(cli_args.profile)
+    if instrumentation_arg:
+        with open(cli_args.report, "w") as report_file:
+            json.dump(instrumentation_arg.report(), report_file, indent=2)
@@ -0,0 +1,239 @@
+"""
+Team Tutorial #4: Benchmarks for the Divvy classes in divvy.py
+
+usage: python divvy_bench.py memory [--trips N]
+       python divvy_bench.py pipeline [--trips N]
+                             [--files <stationFile> <tripFile>]
+                             [--no-memory] [--output <file>]
+
+The memory benchmark compares the memory used per trip by different
+representations of the trips. The pipeline benchmark times (and
+measures the peak memory of) loading a Divvy dataset, computing each
+of the statistics, and producing the full go() report, as well as
+loading only the columns and trips needed for one statistic (see
+TripQuery). Unless data files are given, it runs on synthetic data
+(see divvy_synth.py).
+
+The results are printed (or written) as JSON, so that they can be
+compared between runs.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import divvy
+import divvy_synth
+
+
+class LegacyTrip:
+    """
+    A Divvy trip as it was originally represented: a plain object
+    (with a per-instance dictionary) holding struct_time start and
+    stop times. Used as the "before" case of the memory benchmark.
+    """
+
+    def __init__(self, trip_id, starttime, stoptime, bikeid,
+                 tripduration, from_station, to_station,
+                 usertype, gender, birthyear):
+        self.trip_id = trip_id
+        self.starttime = starttime
+        self.stoptime = stoptime
+        self.bikeid = bikeid
+        self.tripduration = tripduration
+        self.from_station = from_station
+        self.to_station = to_station
+        self.usertype = usertype
+        self.gender = gender
+        self.birthyear = birthyear
+
+
+def timed(f, trace_memory):
+    """
+    Runs a function and measures how long it takes and, optionally,
+    the peak memory allocated while it runs (which makes it slower,
+    so the time is measured in a separate run).
+
+    Args:
+    - f: (function) A function with no arguments
+    - trace_memory: (boolean) Whether to measure the peak memory
+
+    Returns: (dictionary) The time in seconds and the peak memory
+      in bytes (None if it was not measured)
+    """
+    start = time.perf_counter()
+    f()
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if trace_memory:
+        tracemalloc.start()
+        f()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {"seconds": seconds, "peak_bytes": peak}
+
+
+def reset(data):
+    """
+    Forgets the statistics and indexes computed for a dataset, so
+    that each benchmark computes them from scratch.
+    """
+    data.stats = {}
+    data.distance_matrix = None
+    data.bike_index = None
+    data.report = None
+
+
+def bench_pipeline(stations_filename, trips_filename, trace_memory=True):
+    """
+    Times the steps of the Divvy pipeline on a dataset.
+
+    Args:
+    - stations_filename: (string) Path of Divvy stations file
+    - trips_filename: (string) Path of Divvy trips file
+    - trace_memory: (boolean) Whether to also measure peak memory
+
+    Returns: (dictionary) The results
+    """
+    def load():
+        return divvy.DivvyData(stations_filename, trips_filename,
+                               cache_distances=False)
+
+    def load_projected():
+        query = divvy.TripQuery(columns=["bikeid", "tripduration"],
+                                usertypes=["Subscriber"])
+        return divvy.DivvyData(stations_filename, trips_filename,
+                               cache_distances=False, query=query)
+
+    def stat(name):
+        def f():
+            reset(data)
+            getattr(data, name)()
+        return f
+
+    def report():
+        with contextlib.redirect_stdout(io.StringIO()):
+            divvy.go(stations_filename, trips_filename)
+
+    results = {"load": timed(load, trace_memory),
+               "load_projected": timed(load_projected, trace_memory)}
+    data = load()
+    for name in ["get_total_distance", "get_total_duration",
+                 "get_bike_times", "get_bike_movements"]:
+        results[name] = timed(stat(name), trace_memory)
+    results["go"] = timed(report, trace_memory)
+
+    return {"benchmark": "pipeline",
+            "stations_file": stations_filename,
+            "trips_file": trips_filename,
+            "stations": data.get_number_stations(),
+            "trips": data.get_number_trips(),
+            "results": results}
+
+
+def traced_size(build):
+    """
+    Measures the memory allocated by a function (and still in use
+    when it returns).
+
+    Args:
+    - build: (function) A function with no arguments
+
+    Returns: (integer) The number of bytes
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return after - before
+
+
+def bench_memory(n, n_stations=600):
+    """
+    Measures the memory used per trip by the original object
+    representation of the trips, by slotted DivvyTrip objects, and
+    by a columnar TripStore.
+
+    Args:
+    - n: (integer) The number of trips
+    - n_stations: (integer) The number of stations
+
+    Returns: (dictionary) The results
+    """
+    stations = divvy_synth.synthetic_stations(n_stations)
+
+    def legacy_trips():
+        return [LegacyTrip(trip_id, divvy.epoch_to_struct_time(start),
+                           divvy.epoch_to_struct_time(stop), bikeid,
+                           tripduration, stations[from_idx],
+                           stations[to_idx], usertype, gender, birthyear)
+                for (trip_id, start, stop, bikeid, tripduration, from_idx,
+                     to_idx, usertype, gender, birthyear)
+                in divvy_synth.synthetic_trips(n, n_stations)]
+
+    def slotted_trips():
+        return [divvy.DivvyTrip(trip_id, start, stop, bikeid, tripduration,
+                                stations[from_idx], stations[to_idx],
+                                usertype, gender, birthyear)
+                for (trip_id, start, stop, bikeid, tripduration, from_idx,
+                     to_idx, usertype, gender, birthyear)
+                in divvy_synth.synthetic_trips(n, n_stations)]
+
+    def trip_store():
+        trips = divvy.TripStore(stations)
+        for row in divvy_synth.synthetic_trips(n, n_stations):
+            trips.append(row)
+        return trips
+
+    results = {}
+    for name, build in [("objects", legacy_trips),
+                        ("slotted_objects", slotted_trips),
+                        ("columnar", trip_store)]:
+        size = traced_size(build)
+        results[name] = {"bytes": size, "bytes_per_trip": size / n}
+
+    return {"benchmark": "memory", "trips": n, "stations": n_stations,
+            "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("benchmark", choices=["memory", "pipeline"])
+    parser.add_argument("--trips", type=int, default=1000000,
+                        help="number of synthetic trips (default: 1000000)")
+    parser.add_argument("--files", nargs=2,
+                        metavar=("STATION_FILE", "TRIP_FILE"),
+                        help="run the pipeline benchmark on these files "
+                        "instead of synthetic data")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="do not measure peak memory (faster)")
+    parser.add_argument("--output", help="write the results to this file")
+    args = parser.parse_args()
+
+    if args.benchmark == "memory":
+        output = bench_memory(args.trips)
+    elif args.files:
+        output = bench_pipeline(*args.files, not args.no_memory)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            files = divvy_synth.write_dataset(tmp, args.trips)
+            output = bench_pipeline(*files, not args.no_memory)
+            output["synthetic"] = True
+
+    output["python"] = platform.python_version()
+    output["date"] = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
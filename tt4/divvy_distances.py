@@ -0,0 +1,183 @@
+"""
+Team Tutorial #4: Divvy station distances
+
+Distances between Divvy stations: the Haversine formula over many
+pairs of coordinates at once, and the matrix of the distances between
+every pair of stations, which can be cached on disk (see
+divvy.DivvyData.get_distance_matrix).
+"""
+
+import array
+import hashlib
+import math
+import sys
+
+# NumPy is optional: it is only used to speed up batched computations
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EARTH_RADIUS = 6371000.0
+
+
+def haversine_distances(lat1, lon1, lat2, lon2):
+    """
+    Computes the Haversine distance between many pairs of coordinates
+    at once. Uses NumPy if it is available and a pure-Python loop
+    (with the same formula as divvy.Location.distance_to) otherwise.
+
+    Args:
+    - lat1, lon1: (sequences of floats) Coordinates of the origins
+    - lat2, lon2: (sequences of floats) Coordinates of the destinations
+
+    Returns: (sequence of floats) The distance, in meters, between each
+      pair of coordinates (a NumPy array if NumPy is available, an
+      array.array of doubles otherwise).
+    """
+    if np is not None:
+        lat1 = np.asarray(lat1, dtype=np.float64)
+        lon1 = np.asarray(lon1, dtype=np.float64)
+        lat2 = np.asarray(lat2, dtype=np.float64)
+        lon2 = np.asarray(lon2, dtype=np.float64)
+
+        sin_lat = np.sin(np.radians(lat2 - lat1) / 2)
+        sin_lon = np.sin(np.radians(lon2 - lon1) / 2)
+        a = sin_lat * sin_lat + \
+            np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * \
+            sin_lon * sin_lon
+        return EARTH_RADIUS * (2 * np.arcsin(np.sqrt(a)))
+
+    sin, cos, radians = math.sin, math.cos, math.radians
+    asin, sqrt = math.asin, math.sqrt
+
+    distances = array.array("d")
+    for la1, lo1, la2, lo2 in zip(lat1, lon1, lat2, lon2):
+        diff_latitude = radians(la2 - la1)
+        diff_longitude = radians(lo2 - lo1)
+        a = sin(diff_latitude/2) * sin(diff_latitude/2) + \
+            cos(radians(la1)) * cos(radians(la2)) * \
+            sin(diff_longitude/2) * sin(diff_longitude/2)
+        distances.append(EARTH_RADIUS * (2 * asin(sqrt(a))))
+
+    return distances
+
+
+class DistanceMatrix:
+    """
+    Distances between every pair of Divvy stations.
+
+    The distances are kept in a flat array of N*N doubles (where N is
+    the number of stations), so the distance from the station with
+    index i to the station with index j is values[i * N + j].
+
+    A matrix can be saved to disk, tagged with a digest of the stations
+    file it was computed from, so that it only needs to be recomputed
+    when that file changes.
+    """
+
+    MAGIC = "divvy-distances-v1"
+
+    def __init__(self, n, values):
+        """
+        Constructor.
+
+        Args:
+        - n: (integer) The number of stations
+        - values: (array of doubles) The N*N distances, in meters
+        """
+        self.n = n
+        self.values = values
+
+    @staticmethod
+    def build(stations):
+        """
+        Computes the distance matrix for a list of stations.
+
+        Args:
+        - stations: (list of DivvyStation) The stations, in index order
+
+        Returns: (DistanceMatrix) The distances between all the stations
+        """
+        n = len(stations)
+        latitudes = [s.location.latitude for s in stations]
+        longitudes = [s.location.longitude for s in stations]
+
+        distances = haversine_distances(
+            [lat for lat in latitudes for _ in range(n)],
+            [lon for lon in longitudes for _ in range(n)],
+            latitudes * n,
+            longitudes * n)
+
+        return DistanceMatrix(n, array.array("d", distances))
+
+    @staticmethod
+    def load(filename, digest, n):
+        """
+        Loads a distance matrix saved with DistanceMatrix.save.
+
+        Args:
+        - filename: (string) Path of the saved matrix
+        - digest: (string) Digest of the current stations file
+        - n: (integer) The current number of stations
+
+        Returns: (DistanceMatrix) The saved matrix, or None if there is
+          no saved matrix or it does not match the stations file.
+        """
+        expected = "{} {} {} {}\n".format(DistanceMatrix.MAGIC, digest, n,
+                                          sys.byteorder).encode()
+        try:
+            with open(filename, "rb") as f:
+                if f.readline() != expected:
+                    return None
+                values = array.array("d")
+                values.fromfile(f, n * n)
+        except (OSError, EOFError):
+            return None
+
+        return DistanceMatrix(n, values)
+
+    def save(self, filename, digest):
+        """
+        Saves the matrix to disk.
+
+        Args:
+        - filename: (string) Path of the file to write
+        - digest: (string) Digest of the stations file the matrix
+          was computed from
+
+        Returns: (boolean) True if the matrix was saved
+        """
+        header = "{} {} {} {}\n".format(DistanceMatrix.MAGIC, digest, self.n,
+                                        sys.byteorder).encode()
+        try:
+            with open(filename, "wb") as f:
+                f.write(header)
+                self.values.tofile(f)
+        except OSError:
+            return False
+
+        return True
+
+    def distance(self, i, j):
+        """
+        Returns the distance (in meters) from the station with
+        index i to the station with index j
+        """
+        return self.values[i * self.n + j]
+
+
+def file_digest(filename):
+    """
+    Computes the SHA-256 digest of the contents of a file.
+
+    Args:
+    - filename: (string) Path of the file
+
+    Returns: (string) The hexadecimal digest
+    """
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
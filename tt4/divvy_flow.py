@@ -0,0 +1,86 @@
+"""
+Team Tutorial #4: Divvy trip flows
+
+The origin-destination matrix of the Divvy trips, and the station
+aggregates derived from it (see divvy.DivvyData.get_flow_matrix).
+"""
+
+import array
+
+
+class FlowMatrix:
+    """
+    Origin-destination matrix of the trips between stations: the
+    number of trips, and their total duration, from each station to
+    each other station.
+
+    Like divvy_distances.DistanceMatrix, the values are kept in flat
+    arrays of N*N integers (where N is the number of stations),
+    indexed by from_idx * N + to_idx. The matrix can be updated with
+    more trips at any time.
+    """
+
+    def __init__(self, n):
+        """
+        Constructor.
+
+        Args:
+        - n: (integer) The number of stations
+        """
+        self.n = n
+        self.counts = array.array("q", bytes(8 * n * n))
+        self.durations = array.array("q", bytes(8 * n * n))
+
+    def add(self, from_idx, to_idx, tripduration):
+        """Adds a single trip to the matrix"""
+        k = from_idx * self.n + to_idx
+        self.counts[k] += 1
+        self.durations[k] += tripduration
+
+    def update_columns(self, trips):
+        """
+        Adds all the trips in a TripStore to the matrix.
+
+        Args:
+        - trips: (TripStore) The trips
+        """
+        n = self.n
+        counts = self.counts
+        durations = self.durations
+        for from_idx, to_idx, tripduration in zip(
+                trips.from_idx, trips.to_idx, trips.tripduration):
+            k = from_idx * n + to_idx
+            counts[k] += 1
+            durations[k] += tripduration
+
+    def count(self, from_idx, to_idx):
+        """Returns the number of trips from one station to another"""
+        return self.counts[from_idx * self.n + to_idx]
+
+    def duration(self, from_idx, to_idx):
+        """Returns the total duration of the trips between two stations"""
+        return self.durations[from_idx * self.n + to_idx]
+
+    def outflow(self):
+        """
+        Returns: (list of integers) The number of trips that start at
+          each station (the sum of each row of the matrix)
+        """
+        n = self.n
+        return [sum(self.counts[i * n:(i + 1) * n]) for i in range(n)]
+
+    def inflow(self):
+        """
+        Returns: (list of integers) The number of trips that end at
+          each station (the sum of each column of the matrix)
+        """
+        n = self.n
+        return [sum(self.counts[j::n]) for j in range(n)]
+
+    def imbalance(self):
+        """
+        Returns: (list of integers) The net flow of bikes into each
+          station: inflow minus outflow. Stations with a negative
+          value lose bikes and need to be restocked.
+        """
+        return [i - o for i, o in zip(self.inflow(), self.outflow())]
@@ -0,0 +1,101 @@
+"""
+Team Tutorial #4: Instrumentation of the Divvy pipeline
+
+Timers and counters for the stages of the Divvy pipeline, which are
+only recorded when an Instrumentation object is passed to
+divvy.DivvyData (see also the --report option of divvy.py).
+"""
+
+import contextlib
+import functools
+import time
+
+
+class Instrumentation:
+    """
+    Timers and counters for the stages of the Divvy pipeline (reading
+    the files, building indexes, computing each statistic).
+
+    Timers are only placed around whole stages, or around batches of
+    rows when reading the trips file, never around single rows, so
+    the overhead is small even when instrumentation is enabled. When
+    it is disabled (see NullInstrumentation) it is negligible.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """
+        Context manager that adds the time spent in its block to the
+        timer with the given name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            calls, seconds = self.timers.get(name, (0, 0.0))
+            self.timers[name] = (calls + 1,
+                                 seconds + time.perf_counter() - start)
+
+    def count(self, name, n=1):
+        """Adds n to the counter with the given name"""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        """
+        Returns: (dictionary) The timers (number of calls and total
+          seconds), the counters, and the trips file parsing rate
+          (rows per second), if the trips file was read.
+        """
+        report = {"timers": {name: {"calls": calls, "seconds": seconds}
+                             for name, (calls, seconds)
+                             in self.timers.items()},
+                  "counters": dict(self.counters)}
+
+        rows = self.counters.get("trip_rows")
+        _, seconds = self.timers.get("read_trips", (0, 0.0))
+        if rows and seconds > 0:
+            report["trip_rows_per_second"] = rows / seconds
+
+        return report
+
+
+class NullInstrumentation:
+    """
+    Instrumentation that records nothing, used when instrumentation
+    is disabled.
+    """
+
+    enabled = False
+
+    def timer(self, name):
+        """Returns a context manager that does nothing"""
+        return contextlib.nullcontext()
+
+    def count(self, name, n=1):
+        """Does nothing"""
+
+    def report(self):
+        """Returns an empty report"""
+        return {}
+
+
+NO_INSTRUMENTATION = NullInstrumentation()
+
+
+def instrumented(method):
+    """
+    Decorator for the methods of an object with an instrumentation
+    attribute (such as divvy.DivvyData) that adds the time spent in
+    the method to the timer with the method's name.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.instrumentation.timer(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
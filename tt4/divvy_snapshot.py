@@ -0,0 +1,190 @@
+"""
+Team Tutorial #4: Divvy data snapshots
+
+The file format of the binary snapshots of parsed Divvy data (see
+divvy.DivvyData.save_snapshot and divvy.DivvyData.load_snapshot). A
+snapshot is a directory with one raw binary file per column, which
+can be memory-mapped, and a JSON header that describes the columns
+and the source files the data was parsed from, so that a snapshot is
+only used while the source files have not changed.
+"""
+
+import array
+import json
+import mmap
+import os
+import sys
+
+from divvy_distances import file_digest
+
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HASH_LIMIT = 16 * 1024 * 1024
+
+
+def source_file_info(filename, previous=None):
+    """
+    Describes a source file, so that a snapshot made from it can
+    tell whether the file has changed.
+
+    The description includes the size and modification time of the
+    file and, for small files (such as the stations file), a SHA-256
+    digest of its contents. Large files are not hashed: that would
+    take about as long as parsing them.
+
+    Args:
+    - filename: (string) Path of the file
+    - previous: (dictionary) Descriptions from an earlier snapshot,
+      keyed like the current sources. If the file's size and
+      modification time match one of them, its digest is reused.
+
+    Returns: (dictionary) The description of the file
+    """
+    st = os.stat(filename)
+    info = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if st.st_size <= SNAPSHOT_HASH_LIMIT:
+        for old in (previous or {}).values():
+            if old.get("size") == info["size"] and \
+               old.get("mtime_ns") == info["mtime_ns"] and "sha256" in old:
+                info["sha256"] = old["sha256"]
+                break
+        else:
+            info["sha256"] = file_digest(filename)
+    return info
+
+
+def column_types(columns):
+    """
+    Args:
+    - columns: (list of (string, string) tuples) The name and array
+      typecode of each column
+
+    Returns: (dictionary) The typecode and item size of each column,
+      as recorded in a snapshot header
+    """
+    return {name: [typecode, array.array(typecode).itemsize]
+            for name, typecode in columns}
+
+
+def column_filename(dirname, name):
+    """Returns the path of the file of a column in a snapshot"""
+    return os.path.join(dirname, name + ".bin")
+
+
+def map_column(filename, typecode):
+    """
+    Memory-maps a column file written by write_snapshot.
+
+    Args:
+    - filename: (string) Path of the column file
+    - typecode: (string) The array typecode of the column
+
+    Returns: (memoryview) A read-only view of the column values
+    """
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(array.array(typecode))
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return memoryview(mapped).cast(typecode)
+
+
+def write_snapshot(dirname, header, sources, columns):
+    """
+    Writes a snapshot directory.
+
+    Args:
+    - dirname: (string) Path of the snapshot directory
+    - header: (dictionary) The data to save in the JSON header,
+      besides the columns (such as the stations)
+    - sources: (dictionary: string -> string) Paths of the files the
+      data was read from (see source_file_info)
+    - columns: (list of (string, string, array) tuples) The name,
+      array typecode and values of each column
+
+    Returns: (boolean) True if the snapshot was saved
+    """
+    header = dict(header,
+                  version=SNAPSHOT_VERSION,
+                  byteorder=sys.byteorder,
+                  sources={key: source_file_info(filename)
+                           for key, filename in sources.items()},
+                  columns=column_types((name, typecode)
+                                       for name, typecode, _ in columns))
+
+    try:
+        os.makedirs(dirname, exist_ok=True)
+        for name, _, values in columns:
+            with open(column_filename(dirname, name), "wb") as f:
+                f.write(values)
+
+        # The header is written last, so an interrupted save never
+        # leaves a snapshot that looks valid.
+        header_filename = os.path.join(dirname, "header.json")
+        with open(header_filename + ".tmp", "w") as f:
+            json.dump(header, f)
+        os.replace(header_filename + ".tmp", header_filename)
+    except OSError:
+        return False
+
+    return True
+
+
+def read_snapshot_header(dirname, sources, columns):
+    """
+    Reads the header of a snapshot directory written by
+    write_snapshot, if the snapshot can be used.
+
+    Args:
+    - dirname: (string) Path of the snapshot directory
+    - sources: (dictionary: string -> string) Paths of the files the
+      data would otherwise be read from
+    - columns: (list of (string, string) tuples) The name and array
+      typecode of each column
+
+    Returns: (dictionary) The header, or None if there is no snapshot,
+      if it was saved by another version of this module or on a
+      machine with another byte order, or if the source files or the
+      columns have changed since.
+    """
+    try:
+        with open(os.path.join(dirname, "header.json")) as f:
+            header = json.load(f)
+        current = {key: source_file_info(filename, header["sources"])
+                   for key, filename in sources.items()}
+    except (OSError, ValueError, KeyError):
+        return None
+
+    if header["version"] != SNAPSHOT_VERSION \
+       or header["byteorder"] != sys.byteorder \
+       or header["sources"] != current \
+       or header["columns"] != column_types(columns):
+        return None
+
+    return header
+
+
+def map_snapshot_columns(dirname, columns, length):
+    """
+    Memory-maps the columns of a snapshot directory written by
+    write_snapshot.
+
+    Args:
+    - dirname: (string) Path of the snapshot directory
+    - columns: (list of (string, string) tuples) The name and array
+      typecode of each column
+    - length: (integer) The number of values in each column
+
+    Returns: (dictionary) The columns, by name (see map_column), or
+      None if a column file is missing or does not have length values
+    """
+    mapped = {}
+    try:
+        for name, typecode in columns:
+            column = map_column(column_filename(dirname, name), typecode)
+            if len(column) != length:
+                return None
+            mapped[name] = column
+    except OSError:
+        return None
+
+    return mapped
@@ -0,0 +1,213 @@
+"""
+Team Tutorial #4: Spatial index over Divvy stations
+
+Finds the Divvy stations nearest to a location, or within a given
+distance of it (see divvy.DivvyData.get_spatial_index).
+"""
+
+import heapq
+import math
+
+from divvy_distances import EARTH_RADIUS
+
+
+class SpatialIndex:
+    """
+    A k-d tree over the locations of a list of stations, used to find
+    the stations nearest to a location or within a given distance of
+    it without computing the distance to every station.
+
+    The tree is built over the stations' positions on the unit sphere
+    (as x, y, z coordinates). The straight-line (chord) distance
+    between two such points grows with the great-circle distance, so
+    the tree can rank stations by chord distance; the candidates it
+    finds are then ranked with Location.distance_to, so the results
+    are exactly the same as those of a linear scan.
+    """
+
+    # Relative slack used when comparing chord distances, to absorb
+    # rounding differences between the chord and Haversine formulas.
+    SLACK = 1e-9
+
+    def __init__(self, stations):
+        """
+        Constructor.
+
+        Args:
+        - stations: (list of DivvyStation) The stations to index
+        """
+        self.stations = stations
+        self.points = [SpatialIndex.unit_vector(s.location)
+                       for s in stations]
+
+        self.node_station = []
+        self.node_axis = []
+        self.node_left = []
+        self.node_right = []
+        self.root = self.build(list(range(len(stations))), 0)
+
+    @staticmethod
+    def unit_vector(location):
+        """
+        Returns: (float, float, float) The position of a location
+          on the unit sphere
+        """
+        lat = math.radians(location.latitude)
+        lon = math.radians(location.longitude)
+        return (math.cos(lat) * math.cos(lon),
+                math.cos(lat) * math.sin(lon),
+                math.sin(lat))
+
+    def build(self, indices, depth):
+        """
+        Builds the subtree for a list of station indices.
+
+        Returns: (integer) The node at the root of the subtree
+          (-1 for an empty subtree)
+        """
+        if not indices:
+            return -1
+
+        axis = depth % 3
+        indices.sort(key=lambda i: self.points[i][axis])
+        mid = len(indices) // 2
+
+        node = len(self.node_station)
+        self.node_station.append(indices[mid])
+        self.node_axis.append(axis)
+        self.node_left.append(-1)
+        self.node_right.append(-1)
+
+        self.node_left[node] = self.build(indices[:mid], depth + 1)
+        self.node_right[node] = self.build(indices[mid + 1:], depth + 1)
+        return node
+
+    def chord_within(self, point, chord):
+        """
+        Returns: (list of integers) The indices of the stations whose
+          chord distance to a point on the unit sphere is at most chord
+        """
+        r2 = chord * chord
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node < 0:
+                continue
+            i = self.node_station[node]
+            p = self.points[i]
+            d2 = (p[0] - point[0]) ** 2 + (p[1] - point[1]) ** 2 + \
+                (p[2] - point[2]) ** 2
+            if d2 <= r2:
+                found.append(i)
+
+            diff = point[self.node_axis[node]] - p[self.node_axis[node]]
+            if diff < 0:
+                near, far = self.node_left[node], self.node_right[node]
+            else:
+                near, far = self.node_right[node], self.node_left[node]
+            stack.append(near)
+            if diff * diff <= r2:
+                stack.append(far)
+
+        return found
+
+    def kth_chord(self, point, k):
+        """
+        Returns: (float) The chord distance from a point on the unit
+          sphere to its k-th nearest station
+        """
+        heap = []
+
+        def visit(node):
+            if node < 0:
+                return
+            i = self.node_station[node]
+            p = self.points[i]
+            d2 = (p[0] - point[0]) ** 2 + (p[1] - point[1]) ** 2 + \
+                (p[2] - point[2]) ** 2
+            if len(heap) < k:
+                heapq.heappush(heap, -d2)
+            elif d2 < -heap[0]:
+                heapq.heapreplace(heap, -d2)
+
+            diff = point[self.node_axis[node]] - p[self.node_axis[node]]
+            if diff < 0:
+                near, far = self.node_left[node], self.node_right[node]
+            else:
+                near, far = self.node_right[node], self.node_left[node]
+            visit(near)
+            if len(heap) < k or diff * diff <= -heap[0]:
+                visit(far)
+
+        visit(self.root)
+        return math.sqrt(-heap[0])
+
+    def ranked(self, location, indices):
+        """
+        Returns: (list of (DivvyStation, float) tuples) The stations
+          with the given indices and their distance to location,
+          from nearest to farthest
+        """
+        ranked = sorted((location.distance_to(self.stations[i].location), i)
+                        for i in indices)
+        return [(self.stations[i], d) for d, i in ranked]
+
+    def nearest(self, location, k=1):
+        """
+        Finds the stations nearest to a location.
+
+        Args:
+        - location: (Location) The location
+        - k: (integer) The number of stations to return
+
+        Returns: (list of (DivvyStation, float) tuples) The k stations
+          nearest to location and their distance (in meters) to it,
+          from nearest to farthest
+        """
+        k = min(k, len(self.stations))
+        if k <= 0:
+            return []
+
+        point = SpatialIndex.unit_vector(location)
+        chord = self.kth_chord(point, k) * (1 + SpatialIndex.SLACK) + \
+            SpatialIndex.SLACK
+        return self.ranked(location, self.chord_within(point, chord))[:k]
+
+    def within(self, location, radius):
+        """
+        Finds the stations within a given distance of a location.
+
+        Args:
+        - location: (Location) The location
+        - radius: (float) The distance, in meters
+
+        Returns: (list of (DivvyStation, float) tuples) The stations at
+          most radius meters from location and their distance to it,
+          from nearest to farthest
+        """
+        if radius < 0:
+            return []
+
+        angle = min(radius / EARTH_RADIUS, math.pi)
+        chord = 2 * math.sin(angle / 2) * (1 + SpatialIndex.SLACK) + \
+            SpatialIndex.SLACK
+        point = SpatialIndex.unit_vector(location)
+        candidates = self.ranked(location, self.chord_within(point, chord))
+        return [(station, d) for station, d in candidates if d <= radius]
+
+    def nearest_many(self, locations, k=1):
+        """
+        Runs nearest() for each of a list of locations.
+
+        Returns: (list of lists of (DivvyStation, float) tuples)
+        """
+        return [self.nearest(location, k) for location in locations]
+
+    def within_many(self, locations, radius):
+        """
+        Runs within() for each of a list of locations.
+
+        Returns: (list of lists of (DivvyStation, float) tuples)
+        """
+        return [self.within(location, radius) for location in locations]
@@ -0,0 +1,186 @@
+"""
+Team Tutorial #4: Synthetic Divvy data
+
+Writes station and trip files in the same format as the Divvy data
+files (see data/get_files.sh), so divvy.py can be tried out and
+benchmarked at any scale without downloading the real data.
+
+usage: python divvy_synth.py <directory> [--trips N] [--stations N]
+"""
+
+import argparse
+import csv
+import functools
+import os
+import random
+import time
+
+import divvy
+import divvy_time
+
+STATIONS_HEADER = ["id", "name", "latitude", "longitude", "dpcapacity",
+                   "landmark", "online date"]
+
+TRIPS_HEADER = ["trip_id", "starttime", "stoptime", "bikeid",
+                "tripduration", "from_station_id", "from_station_name",
+                "to_station_id", "to_station_name", "usertype", "gender",
+                "birthday"]
+
+# Probability that a bike is moved by Divvy between two trips
+MOVE_PROBABILITY = 0.05
+
+
+def synthetic_stations(n, seed=0):
+    """
+    Generates Divvy stations scattered around Chicago.
+
+    Args:
+    - n: (integer) The number of stations
+    - seed: (integer) Seed for the random number generator
+
+    Returns: (list of DivvyStation) The stations
+    """
+    rng = random.Random(seed)
+    online_date = time.strptime("6/28/2013", "%m/%d/%Y")
+    return [divvy.DivvyStation(i + 1, "Station {}".format(i + 1),
+                               41.75 + rng.random() * 0.25,
+                               -87.75 + rng.random() * 0.2,
+                               rng.choice([11, 15, 19, 23, 27, 31]),
+                               i, online_date)
+            for i in range(n)]
+
+
+def synthetic_trips(n, n_stations, seed=0):
+    """
+    Generates Divvy trips, sorted by start time. Each bike usually
+    starts a trip where its previous trip ended, but is sometimes
+    moved to another station in between.
+
+    Args:
+    - n: (integer) The number of trips
+    - n_stations: (integer) The number of stations
+    - seed: (integer) Seed for the random number generator
+
+    Returns: (generator of tuples) The fields of each trip, in the
+      order given by TripStore.COLUMNS (stations are indices)
+    """
+    rng = random.Random(seed)
+    n_bikes = max(1, n // 250)
+    bike_stations = {}
+    start = divvy_time.parse_time_fast("2013-06-27 00:00")
+
+    for trip_id in range(1, n + 1):
+        start += rng.choice([0, 0, 0, 60, 60, 120])
+        tripduration = rng.randint(60, 3600)
+
+        bikeid = rng.randint(1, n_bikes)
+        from_idx = bike_stations.get(bikeid)
+        if from_idx is None or rng.random() < MOVE_PROBABILITY:
+            from_idx = rng.randrange(n_stations)
+        to_idx = rng.randrange(n_stations)
+        bike_stations[bikeid] = to_idx
+
+        usertype = rng.choice(["Customer", "Subscriber", "Subscriber"])
+        if usertype == "Subscriber":
+            gender = rng.choice(["Male", "Male", "Female", ""])
+            birthyear = rng.randint(1940, 1997)
+        else:
+            gender = None
+            birthyear = 0
+
+        yield (trip_id, start, start + tripduration, bikeid, tripduration,
+               from_idx, to_idx, usertype, gender, birthyear)
+
+
+@functools.lru_cache(maxsize=4096)
+def format_time(t):
+    """
+    Formats seconds since the epoch as a Divvy timestamp
+    (e.g., "2013-06-27 12:11")
+    """
+    return time.strftime(divvy_time.DIVVY_TIME_FORMAT, time.gmtime(t))
+
+
+def write_stations_file(filename, stations):
+    """
+    Writes a Divvy stations file.
+
+    Args:
+    - filename: (string) Path of the file
+    - stations: (list of DivvyStation) The stations
+    """
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(STATIONS_HEADER)
+        for s in stations:
+            online_date = "{}/{}/{}".format(s.online_date.tm_mon,
+                                            s.online_date.tm_mday,
+                                            s.online_date.tm_year)
+            writer.writerow([s.station_id, s.name, s.location.latitude,
+                             s.location.longitude, s.dpcapacity,
+                             s.landmark, online_date])
+
+
+def write_trips_file(filename, trips, stations):
+    """
+    Writes a Divvy trips file.
+
+    Args:
+    - filename: (string) Path of the file
+    - trips: (iterable of tuples) The fields of each trip (see
+      synthetic_trips)
+    - stations: (list of DivvyStation) The stations the trips
+      refer to, by index
+    """
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(TRIPS_HEADER)
+        for (trip_id, start, stop, bikeid, tripduration, from_idx, to_idx,
+             usertype, gender, birthyear) in trips:
+            from_station = stations[from_idx]
+            to_station = stations[to_idx]
+            writer.writerow([trip_id, format_time(start), format_time(stop),
+                             bikeid, tripduration,
+                             from_station.station_id, from_station.name,
+                             to_station.station_id, to_station.name,
+                             usertype, gender or "", birthyear or ""])
+
+
+def write_dataset(dirname, n_trips, n_stations=600, seed=0):
+    """
+    Writes a synthetic stations file and trips file.
+
+    Args:
+    - dirname: (string) The directory for the files
+    - n_trips: (integer) The number of trips
+    - n_stations: (integer) The number of stations
+    - seed: (integer) Seed for the random number generator
+
+    Returns: (string, string) The paths of the stations file and
+      the trips file
+    """
+    os.makedirs(dirname, exist_ok=True)
+    stations_filename = os.path.join(dirname, "synthetic_stations.csv")
+    trips_filename = os.path.join(dirname, "synthetic_trips.csv")
+
+    stations = synthetic_stations(n_stations, seed)
+    write_stations_file(stations_filename, stations)
+    write_trips_file(trips_filename,
+                     synthetic_trips(n_trips, n_stations, seed), stations)
+
+    return stations_filename, trips_filename
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("directory")
+    parser.add_argument("--trips", type=int, default=10000,
+                        help="number of trips (default: 10000)")
+    parser.add_argument("--stations", type=int, default=600,
+                        help="number of stations (default: 600)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for path in write_dataset(args.directory, args.trips, args.stations,
+                              args.seed):
+        print(path)
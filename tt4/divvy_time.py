@@ -0,0 +1,198 @@
+"""
+Team Tutorial #4: Divvy timestamps
+
+Parses the timestamps of the Divvy trips files into seconds since the
+epoch (as stored in a divvy.TripStore), and indexes the trips by start
+time (see divvy.DivvyData.get_time_index).
+"""
+
+import array
+import bisect
+import calendar
+import datetime
+import functools
+import time
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+
+def epoch_to_struct_time(t):
+    """
+    Converts a time in seconds since the epoch (as stored in a TripStore)
+    back to the struct_time that time.strptime would have produced for
+    the same date and time.
+
+    Args:
+    - t: (integer) Seconds since the epoch (UTC, no DST adjustment)
+
+    Returns: (struct_time) The corresponding date and time
+    """
+    return time.struct_time(time.gmtime(t)[:8] + (-1,))
+
+
+DIVVY_TIME_FORMAT = "%Y-%m-%d %H:%M"
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def parse_time_strptime(s):
+    """
+    Parses a Divvy timestamp (e.g., "2013-06-27 12:11") with
+    time.strptime.
+
+    Args:
+    - s: (string) The timestamp
+
+    Returns: (integer) Seconds since the epoch (UTC, no DST adjustment)
+    """
+    return calendar.timegm(time.strptime(s, DIVVY_TIME_FORMAT))
+
+
+# Many trips start (and end) in the same minute, so the results are
+# memoized. Trips are sorted by start time, and most end soon after
+# they start, so a small cache (about three days of minutes) hits
+# nearly as often as an unbounded one, without keeping memory pinned.
+@functools.lru_cache(maxsize=4096)
+def parse_time_fast(s):
+    """
+    Parses a Divvy timestamp (e.g., "2013-06-27 12:11") without going
+    through time.strptime. Timestamps that do not have exactly the
+    "YYYY-MM-DD HH:MM" layout are handed to parse_time_strptime, so
+    the results are always the same as those of parse_time_strptime.
+
+    Args:
+    - s: (string) The timestamp
+
+    Returns: (integer) Seconds since the epoch (UTC, no DST adjustment)
+    """
+    if len(s) == 16 and s[4] == "-" and s[7] == "-" and s[10] == " " \
+       and s[13] == ":":
+        digits = s[0:4] + s[5:7] + s[8:10] + s[11:13] + s[14:16]
+        hour = int(s[11:13])
+        minute = int(s[14:16])
+        if digits.isascii() and digits.isdigit() and hour < 24 \
+           and minute < 60 and s[0:4] != "0000":
+            day = datetime.date(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+            return (day.toordinal() - EPOCH_ORDINAL) * DAY + \
+                hour * HOUR + minute * MINUTE
+
+    return parse_time_strptime(s)
+
+
+TIME_PARSERS = {"fast": parse_time_fast,
+                "strptime": parse_time_strptime}
+
+
+class TimeIndex:
+    """
+    An index over the start times of the trips in a TripStore, which
+    must be sorted by start time (as they are in the trips file).
+
+    Range queries use binary search over the start column. The
+    offsets of the trips that start in each hour and each day are
+    computed when the index is built, so per-hour and per-day counts
+    do not need to look at the trips at all.
+    """
+
+    def __init__(self, trips):
+        """
+        Constructor.
+
+        Args:
+        - trips: (TripStore) The trips to index
+        """
+        start = trips.start
+        for i in range(1, len(start)):
+            if start[i] < start[i - 1]:
+                raise ValueError("Trips are not sorted by start time "
+                                 "(trip {})".format(trips.trip_id[i]))
+
+        self.trips = trips
+        self.hour_offsets, self.first_hour = self.bucket_offsets(HOUR)
+        self.day_offsets, self.first_day = self.bucket_offsets(DAY)
+
+    def bucket_offsets(self, size):
+        """
+        Finds where the trips of each time bucket (hour or day) start.
+
+        Args:
+        - size: (integer) The size of the buckets, in seconds
+
+        Returns: (array of integers, integer) The offsets, such that
+          the trips in bucket b are trips offsets[b] to
+          offsets[b + 1] - 1, and the bucket of the first trip
+          (as a number of buckets since the epoch)
+        """
+        start = self.trips.start
+        offsets = array.array("q")
+        if len(start) == 0:
+            return offsets, 0
+
+        first = start[0] // size
+        last = start[-1] // size
+        for bucket in range(first, last + 1):
+            offsets.append(bisect.bisect_left(start, bucket * size))
+        offsets.append(len(start))
+        return offsets, first
+
+    @staticmethod
+    def to_epoch(t):
+        """
+        Converts a time given as seconds since the epoch or as a Divvy
+        timestamp (e.g., "2013-06-27 12:11") to seconds since the epoch
+        """
+        if isinstance(t, str):
+            return parse_time_fast(t)
+        return t
+
+    def positions_between(self, start, end):
+        """
+        Returns: (integer, integer) The positions of the first trip
+          that starts at or after start and of the first trip that
+          starts at or after end
+        """
+        column = self.trips.start
+        return (bisect.bisect_left(column, TimeIndex.to_epoch(start)),
+                bisect.bisect_left(column, TimeIndex.to_epoch(end)))
+
+    def between(self, start, end):
+        """
+        Finds the trips that start in a time range.
+
+        Args:
+        - start, end: (integers or strings) The range, from start
+          (included) to end (excluded), in seconds since the epoch or
+          as Divvy timestamps
+
+        Returns: (TripStore) A zero-copy slice of the trips
+        """
+        return self.trips.slice(*self.positions_between(start, end))
+
+    def count_between(self, start, end):
+        """Returns the number of trips that start in a time range"""
+        lo, hi = self.positions_between(start, end)
+        return hi - lo
+
+    def trips_per_hour(self):
+        """
+        Returns: (list of integers) The number of trips that start in
+          each hour of the day (0 to 23)
+        """
+        counts = [0] * 24
+        offsets = self.hour_offsets
+        for b in range(len(offsets) - 1):
+            counts[(self.first_hour + b) % 24] += offsets[b + 1] - offsets[b]
+        return counts
+
+    def trips_per_weekday(self):
+        """
+        Returns: (list of integers) The number of trips that start on
+          each day of the week (Monday is 0, as in struct_time)
+        """
+        counts = [0] * 7
+        offsets = self.day_offsets
+        for b in range(len(offsets) - 1):
+            # January 1st, 1970 was a Thursday
+            counts[(self.first_day + b + 3) % 7] += offsets[b + 1] - offsets[b]
+        return counts
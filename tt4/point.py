@@ -5,6 +5,9 @@ Team Tutorial #4: Point class
 import math
 
 class Point:
+    # Use slots instead of a per-instance dictionary, to save memory
+    __slots__ = ("x", "y")
+
     def __init__(self, x, y):
         """
         Constructor for the Point class
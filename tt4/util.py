@@ -1,6 +1,11 @@
 import csv
+import functools
+import os
+
 import library
 
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
 def read_csv(filename):
     libs = []
     with open(filename) as csvfile:
@@ -13,4 +18,16 @@ def read_csv(filename):
                                         int(row["MICROFORM"])))
     return libs
 
-HI_LCS_2011 = read_csv("data/libraries-collection-statistics-2011-csv.csv")
\ No newline at end of file
+@functools.lru_cache(maxsize=None)
+def load_hi_lcs_2011():
+    # Read on first use only; later calls share the same list
+    return read_csv(os.path.join(
+        DATA_DIR, "libraries-collection-statistics-2011-csv.csv"))
+
+def __getattr__(name):
+    # HI_LCS_2011 is loaded when it is first used (as util.HI_LCS_2011
+    # or with "from util import HI_LCS_2011"), not at import time
+    if name == "HI_LCS_2011":
+        return load_hi_lcs_2011()
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))